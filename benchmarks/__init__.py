@@ -0,0 +1,3 @@
+'''
+Benchmarks for lunchbot. Run a module with e.g. python -m benchmarks.bench_parse_weather
+'''
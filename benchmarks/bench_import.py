@@ -0,0 +1,65 @@
+'''
+Import-time benchmark of the lunchbot CLI.
+
+    python -m benchmarks.bench_import [--repeat N] [--max-ms MS]
+
+Times `lunchbot --help` and a bare import of each entry point in fresh interpreters, and checks
+none of them imports the heavy modules the stages load lazily. Exits with 1 on a regression:
+a heavy module imported at startup, or `--help` slower than --max-ms.
+'''
+
+import argparse
+import json
+import subprocess
+import sys
+import time
+
+# Modules only the stages that need them may import
+HEAVY_MODULES = ('pandas', 'numpy', 'selenium', 'requests')
+
+ENTRY_POINTS = ('lunchbot.lounasbotti', 'lunchbot.batch', 'lunchbot.service')
+
+IMPORTED = 'import json, sys; import {module}; print(json.dumps(sorted(m for m in {heavy} if m in sys.modules)))'
+
+
+def run(args) -> float:
+    '''Wall time of one fresh interpreter running <args>, in milliseconds.'''
+    start = time.perf_counter()
+    subprocess.run([sys.executable, *args], check = True, stdout = subprocess.DEVNULL)
+    return (time.perf_counter() - start) * 1000
+
+
+def heavy_imports(module: str) -> list:
+    output = subprocess.run([sys.executable, '-c', IMPORTED.format(module = module, heavy = HEAVY_MODULES)],
+                            check = True, capture_output = True, text = True).stdout
+    return json.loads(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type = int, default = 5)
+    parser.add_argument('--max-ms', type = float, default = None,
+                        help = 'Fail if the fastest `lunchbot --help` takes longer than this')
+    args = parser.parse_args()
+
+    failed = False
+    baseline = min(run(['-c', 'pass']) for _ in range(args.repeat))
+    print(f"{'command':<36} {'best ms':>8} {'over python':>12}  heavy modules")
+
+    for module in ENTRY_POINTS:
+        best = min(run(['-c', f'import {module}']) for _ in range(args.repeat))
+        heavy = heavy_imports(module)
+        failed |= bool(heavy)
+        print(f"{'import ' + module:<36} {best:>8.1f} {best - baseline:>12.1f}  {', '.join(heavy) or '-'}")
+
+    best = min(run(['-m', 'lunchbot.lounasbotti', '--help']) for _ in range(args.repeat))
+    print(f"{'lunchbot --help':<36} {best:>8.1f} {best - baseline:>12.1f}")
+    if args.max_ms is not None and best > args.max_ms:
+        print(f'lunchbot --help took {best:.1f} ms, over the limit of {args.max_ms} ms')
+        failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
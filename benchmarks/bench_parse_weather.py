@@ -0,0 +1,68 @@
+'''
+Micro-benchmark of weather.parse_weather_xml against the ElementTree implementation it replaced.
+
+    python -m benchmarks.bench_parse_weather [--repeat N]
+'''
+
+import argparse
+import timeit
+import xml.etree.ElementTree as ET
+
+import pandas as pd
+
+from benchmarks.fixtures import fmi_xml
+from lunchbot.weather import parse_weather_xml
+
+# Forecast windows to parse, in hours
+WINDOWS = (3, 12, 48, 240)
+
+
+def parse_weather_xml_tree(xml_data: str) -> pd.DataFrame:
+    '''
+    The previous parser: full tree, four .// searches per element and a list of dicts.
+    '''
+    root = ET.fromstring(xml_data)
+    records = []
+
+    for element in root.findall('.//BsWfs:BsWfsElement', namespaces={'BsWfs': 'http://xml.fmi.fi/schema/wfs/2.0'}):
+        try:
+            records.append({
+                'Location': element.find('.//gml:pos', namespaces={'gml': 'http://www.opengis.net/gml/3.2'}).text,
+                'Time': element.find('.//BsWfs:Time', namespaces={'BsWfs': 'http://xml.fmi.fi/schema/wfs/2.0'}).text,
+                'ParameterName': element.find('.//BsWfs:ParameterName', namespaces={'BsWfs': 'http://xml.fmi.fi/schema/wfs/2.0'}).text,
+                'ParameterValue': float(element.find('.//BsWfs:ParameterValue', namespaces={'BsWfs': 'http://xml.fmi.fi/schema/wfs/2.0'}).text)
+            })
+        except AttributeError:
+            pass  # Skip entries with missing data
+
+    df = pd.DataFrame(records)
+    df['Time'] = pd.to_datetime(df['Time'])
+    return df
+
+
+def best_of(function, argument, repeat: int) -> float:
+    '''Fastest of <repeat> runs, in milliseconds.'''
+    return min(timeit.repeat(lambda: function(argument), number = 1, repeat = repeat)) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type = int, default = 5)
+    args = parser.parse_args()
+
+    print(f"{'hours':>6} {'bytes':>10} {'tree ms':>9} {'stream ms':>10} {'speedup':>8}")
+    for hours in WINDOWS:
+        xml_data = fmi_xml(hours = hours)
+
+        # Both parsers have to agree before their timings mean anything
+        expected = parse_weather_xml_tree(xml_data)
+        actual = parse_weather_xml(xml_data)
+        pd.testing.assert_frame_equal(actual.astype({'Location': object, 'ParameterName': object}), expected)
+
+        tree = best_of(parse_weather_xml_tree, xml_data, args.repeat)
+        stream = best_of(parse_weather_xml, xml_data, args.repeat)
+        print(f'{hours:>6} {len(xml_data):>10} {tree:>9.2f} {stream:>10.2f} {tree / stream:>7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+'''
+Offline end-to-end benchmark of lunchbot, stage by stage and as a whole.
+
+    python -m benchmarks.bench_pipeline [--repeat N] [--output report.json] [--compare base.json]
+
+lounaat.info and opendata.fmi.fi are replaced by a local stub server serving the fixtures,
+so timings only depend on lunchbot itself. Results are written as JSON, keyed by
+stage[case], and --compare prints the ratio of each median to a previous report.
+'''
+
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+from benchmarks.fixtures import fmi_xml, lounaat_html
+from benchmarks.stub_server import StubServer
+from lunchbot import lounasbotti, restaurant_scraper, weather
+
+# Restaurants listed on the recorded pages, by case
+PAGES = {'small': 10, 'medium': 40, 'large': 200}
+
+# Forecast window of the recorded FMI responses in hours, by case
+FORECASTS = {'short': 3, 'day': 12, 'long': 48}
+
+# time_of_day the weather stages look up, inside every forecast window
+HOUR = 11
+
+
+def measure(function, repeat):
+    '''Run <function> <repeat> times and summarise the wall times in milliseconds.'''
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append((time.perf_counter() - start) * 1000)
+    return {'min_ms': min(times), 'median_ms': statistics.median(times), 'mean_ms': statistics.fmean(times),
+            'runs': repeat}
+
+
+def run_main(args):
+    # Every run downloads its forecast, like a fresh process would
+    weather.forecasts.clear()
+    with contextlib.redirect_stdout(io.StringIO()):
+        lounasbotti.main.main(args, standalone_mode = False)
+
+
+def run_benchmarks(repeat):
+    results = {}
+
+    def record(stage, case, function):
+        results[f'{stage}[{case}]'] = measure(function, repeat)
+        print(f"{stage + '[' + case + ']':<40} {results[f'{stage}[{case}]']['median_ms']:>10.3f} ms")
+
+    for case in PAGES:
+        url = restaurant_scraper.location_url(f'{case}-turku')
+        result_list = restaurant_scraper.get_menu_list(url, backend = 'http')
+        cleaned = restaurant_scraper.clean_menu_list(result_list)
+        record('get_menu_list', case, lambda: restaurant_scraper.get_menu_list(url, backend = 'http'))
+        record('clean_menu_list', case, lambda: restaurant_scraper.clean_menu_list(result_list))
+        record('create_df', case, lambda: restaurant_scraper.create_df(cleaned))
+        record('Restaurants.from_cleaned', case, lambda: restaurant_scraper.Restaurants.from_cleaned(cleaned))
+        restaurants = restaurant_scraper.Restaurants.from_cleaned(cleaned)
+        record('select_restaurants', case, lambda: lounasbotti.select_restaurants(restaurants, None, 500, False))
+
+    for case, hours in FORECASTS.items():
+        xml_data = fmi_xml(hours = hours)
+        weather_df = weather.get_weather(weather.parse_weather_xml(xml_data))
+        weather_index = weather.index_weather(weather_df)
+        hour_data = weather.get_weather_by_hour(weather_index, HOUR)
+        records = list(weather._iter_weather_elements(xml_data))
+        record('parse_weather_xml', case, lambda: weather.parse_weather_xml(xml_data))
+        record('weather_from_records', case, lambda: weather.weather_from_records(records))
+        record('index_weather', case, lambda: weather.index_weather(weather_df))
+        record('get_weather_by_hour', case, lambda: weather.get_weather_by_hour(weather_index, HOUR))
+        record('terrace_weather', case, lambda: weather.terrace_weather(hour_data, min_temp = 20))
+        record('terrace_weather_by_hour', case, lambda: weather.terrace_weather_by_hour(weather_index, min_temp = 20))
+
+    window = weather.forecast_window(HOUR, HOUR + 1)
+    weather.forecasts.records('turku', *window)
+    record('ForecastStore.records', 'reused', lambda: weather.forecasts.records('turku', *window))
+
+    for case in PAGES:
+        args = ['--location', f'{case}-turku', '--time_of_day', str(HOUR), '--backend', 'http', '--no-cache', '--no-history']
+        record('main', case, lambda: run_main(args))
+        record('main_lean', case, lambda: run_main([*args, '--lean']))
+
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output = True, text = True,
+                              check = True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path, threshold):
+    with open(baseline_path, encoding = 'utf-8') as f:
+        baseline = json.load(f)
+    print(f"\n{'stage[case]':<40} {'base ms':>10} {'new ms':>10} {'ratio':>7}   (base {baseline['meta']['commit']})")
+    regressions = []
+    for key, stats in results.items():
+        if key not in baseline['results']:
+            continue
+        base = baseline['results'][key]['median_ms']
+        ratio = stats['median_ms'] / base if base else float('inf')
+        flag = ' !' if ratio > threshold else ''
+        print(f"{key:<40} {base:>10.3f} {stats['median_ms']:>10.3f} {ratio:>6.2f}x{flag}")
+        if flag:
+            regressions.append(key)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type = int, default = 7)
+    parser.add_argument('--output', help = 'Write the JSON report here')
+    parser.add_argument('--compare', help = 'JSON report of an earlier run to compare against')
+    parser.add_argument('--threshold', type = float, default = 1.25,
+                        help = 'With --compare, exit with 1 if a median grew more than this factor')
+    args = parser.parse_args()
+
+    pages = {f'/{case}-turku': (lounaat_html(n_restaurants = n), 'text/html; charset=utf-8')
+             for case, n in PAGES.items()}
+    # The forecast is for today, the day lunchbot asks for
+    today = datetime.datetime.now(datetime.timezone.utc).date().isoformat()
+    pages['/wfs'] = (fmi_xml(hours = FORECASTS['day'], day = today), 'text/xml; charset=utf-8')
+
+    with StubServer(pages) as server:
+        restaurant_scraper.LOUNAAT_URL = server.url
+        weather.FMI_URL = f'{server.url}/wfs'
+        results = run_benchmarks(args.repeat)
+
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'created': datetime.datetime.now().isoformat(timespec = 'seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'repeat': args.repeat,
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding = 'utf-8') as f:
+            json.dump(report, f, indent = 2)
+
+    if args.compare and compare(results, args.compare, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+'''
+FMI WFS forecast responses and lounaat.info pages for the benchmarks.
+
+The documents follow the ecmwf::forecast::surface::point::simple responses of opendata.fmi.fi
+and the location pages of lounaat.info element for element, with deterministic values so runs
+are comparable between commits.
+'''
+
+import datetime
+
+# Parameters the simple stored query returns, in the order FMI lists them
+FMI_PARAMETERS = (
+    'GeopHeight', 'Temperature', 'Pressure', 'Humidity', 'WindDirection', 'WindSpeedMS',
+    'WindUMS', 'WindVMS', 'PrecipitationAmount', 'TotalCloudCover', 'LowCloudCover',
+    'MediumCloudCover', 'HighCloudCover', 'Precipitation1h', 'MaximumWind', 'WindGust',
+    'DewPoint',
+)
+
+HEADER = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<wfs:FeatureCollection timeStamp="{stamp}" numberMatched="{n}" numberReturned="{n}" '
+    'xmlns:wfs="http://www.opengis.net/wfs/2.0" xmlns:gml="http://www.opengis.net/gml/3.2" '
+    'xmlns:BsWfs="http://xml.fmi.fi/schema/wfs/2.0" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+    'xsi:schemaLocation="http://www.opengis.net/wfs/2.0 http://xml.fmi.fi/schema/wfs/2.0/wfs.xsd '
+    'http://xml.fmi.fi/schema/wfs/2.0 http://xml.fmi.fi/schema/wfs/2.0/fmi_wfs_simplefeature.xsd">\n'
+)
+
+MEMBER = '''\t<wfs:member>
+\t\t<BsWfs:BsWfsElement gml:id="BsWfsElement.1.{i}.{j}">
+\t\t\t<BsWfs:Location>
+\t\t\t\t<gml:Point gml:id="BsWfsElementP.1.{i}.{j}" srsDimension="2" srsName="http://www.opengis.net/def/crs/EPSG/0/4258">
+\t\t\t\t\t<gml:pos>{pos} </gml:pos>
+\t\t\t\t</gml:Point>
+\t\t\t</BsWfs:Location>
+\t\t\t<BsWfs:Time>{time}</BsWfs:Time>
+\t\t\t<BsWfs:ParameterName>{name}</BsWfs:ParameterName>
+\t\t\t<BsWfs:ParameterValue>{value}</BsWfs:ParameterValue>
+\t\t</BsWfs:BsWfsElement>
+\t</wfs:member>
+'''
+
+
+def _value(hour: int, index: int, name: str) -> str:
+    if name in ('WindSpeedMS', 'TotalCloudCover') and hour % 3:
+        return 'NaN'
+    if name in ('Precipitation1h', 'PrecipitationAmount'):
+        return '0.0' if hour % 2 else f'{hour % 4 * 0.6:.1f}'
+    return f'{(hour * 7 + index * 3) % 25 + 0.5:.1f}'
+
+
+def fmi_xml(hours: int = 12, day: str = '2024-10-18', start_hour: int = 8,
+            pos: str = '60.45148 22.26869', parameters: tuple = FMI_PARAMETERS) -> str:
+    '''
+    Forecast for one place, one element per parameter per hour from start_hour for <hours> hours.
+    '''
+    start = datetime.datetime.fromisoformat(day) + datetime.timedelta(hours = start_hour)
+    members = []
+    for i in range(hours + 1):
+        time = (start + datetime.timedelta(hours = i)).strftime('%Y-%m-%dT%H:%M:%SZ')
+        for j, name in enumerate(parameters):
+            members.append(MEMBER.format(i = i + 1, j = j + 1, pos = pos, time = time,
+                                         name = name, value = _value(i, j, name)))
+    header = HEADER.format(stamp = f'{day}T07:00:00Z', n = len(members))
+    return header + ''.join(members) + '</wfs:FeatureCollection>\n'
+
+
+DISHES = (
+    'Lohikeitto L, G', 'Broileria currykastikkeessa, riisiä M, G', 'Kasvislasagnette VE',
+    'Jauhelihapihvit, perunamuusia L', 'Kinkkukiusaus L, G', 'Falafel-bowl VE, G',
+    'Paahdettua porsasta, kermaperunat L', 'Pinaattiletut, puolukkahilloa L',
+)
+
+RESTAURANT = '''<div class="menu item category-{category} lunch" data-id="{i}">
+  <div class="item-header"><h3><a href="/lounas/ravintola-{i}/turku">{name}</a></h3>
+  <p class="lunch">{hours}</p></div>
+  <div class="item-body"><ul>{dishes}</ul></div>
+  <div class="item-footer"><p class="dist" title="Etäisyys">{distance}m</p><div class="rating">{rating}/5</div></div>
+</div>
+'''
+
+DISH = '<li class="menu-item"><p class="dish">{dish}</p><p class="price">{price:.2f} €</p></li>'
+
+# Markup around the listing; the real page has hundreds of divs for navigation, ads and the map
+FILLER = '<div class="banner"><div class="inner"><a href="/mainos/{i}">Mainos {i}</a></div></div>\n'
+
+
+def lounaat_html(n_restaurants: int = 40, filler: int = 200) -> str:
+    '''
+    A lounaat.info location page listing <n_restaurants> restaurants, every seventh of them a
+    student restaurant that clean_menu_list drops, among <filler> unrelated divs.
+    '''
+    restaurants = []
+    for i in range(n_restaurants):
+        name = f'Unica Ravintola {i}' if i % 7 == 3 else f'Ravintola {i}'
+        dishes = ''.join(DISH.format(dish = DISHES[(i + j) % len(DISHES)], price = 9.5 + j)
+                         for j in range(2 + i % 4))
+        restaurants.append(RESTAURANT.format(
+            category = i % 5, i = i, name = name, hours = f'Avoinna 10.{30 + i % 2 * 15}–14.00',
+            dishes = dishes, distance = 50 + i * 37 % 950, rating = f'{3 + i % 20 / 10:.1f}'))
+    page = ['<!DOCTYPE html><html lang="fi"><head><title>Lounaat</title>'
+            '<script>var menu = "<div class=\\"menu item\\">";</script></head><body>\n']
+    page += [FILLER.format(i = i) for i in range(filler // 2)]
+    page.append('<div id="menu">\n' + ''.join(restaurants) + '</div>\n')
+    page += [FILLER.format(i = i) for i in range(filler // 2, filler)]
+    page.append('</body></html>\n')
+    return ''.join(page)
@@ -0,0 +1,47 @@
+'''
+Local stand-ins for lounaat.info and opendata.fmi.fi, serving fixtures so benchmarks run offline.
+'''
+
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+
+class StubHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        body, content_type = self.server.pages.get(path, (None, None))
+        if body is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Keep benchmark output clean
+
+
+class StubServer:
+    '''
+    Serves <pages>, a dict of path -> (body, content type), on a free localhost port in a background thread.
+    Use as a context manager; url is the base URL of the server.
+    '''
+
+    def __init__(self, pages):
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+        self._server.pages = {path: (body.encode('utf-8') if isinstance(body, str) else body, content_type)
+                              for path, (body, content_type) in pages.items()}
+        self._thread = threading.Thread(target = self._server.serve_forever, daemon = True)
+        self.url = f'http://127.0.0.1:{self._server.server_port}'
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._server.shutdown()
+        self._server.server_close()
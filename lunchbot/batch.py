@@ -0,0 +1,111 @@
+'''
+Prints the restaurant for today and the weather for several offices in one run
+'''
+
+from concurrent.futures import ThreadPoolExecutor, wait
+from .lounasbotti import (FETCH_TIMEOUT, fetch_restaurants, fetch_weather, pick_weights, print_report, record_pick,
+                          select_restaurants)
+from .restaurant_scraper import BACKENDS, DriverPool, location_url
+import click
+import sys
+
+
+def read_locations(locations, location_file):
+    '''
+    Locations from the command line followed by the ones in location_file (one per line,
+    # starts a comment), without duplicates.
+    '''
+    locations = list(locations)
+    if location_file is not None:
+        for line in location_file:
+            line = line.split('#')[0].strip()
+            if line:
+                locations.append(line)
+    return list(dict.fromkeys(locations))
+
+
+@click.command()
+@click.argument('locations', nargs=-1)
+@click.option('--file', 'location_file', type=click.File('r'), default=None,
+              help='File with one location per line, read in addition to the LOCATIONS arguments')
+@click.option('--workers', type=int, default=4,
+              help='Offices fetched at the same time, also the number of browsers started at most (default: 4)')
+@click.option('--max_distance', type=int, default=500,
+              help='Specify the maximum distance in meters (default: 500)')
+@click.option('--time_of_day', type=int, default=11,
+              help='Specify the time of day in hours (default: 11)')
+@click.option('--ignore_rain/--no-ignore_rain', default=False,
+              help='Specify whether to ignore rain (default: False)')
+@click.option('--backend', type=click.Choice(['auto', *BACKENDS]), default='auto',
+              help='Scraping backend, auto falls back to selenium if plain HTTP finds nothing (default: auto)')
+@click.option('--timeout', type=float, default=FETCH_TIMEOUT,
+              help=f'Seconds to wait for each office before giving up (default: {FETCH_TIMEOUT})')
+@click.option('--cache/--no-cache', 'use_cache', default=True,
+              help='Reuse menus fetched today and the forecast fetched this hour (default: True)')
+@click.option('--refresh', is_flag=True, default=False,
+              help='Fetch everything again and update the cache')
+@click.option('--history/--no-history', 'use_history', default=True,
+              help='Archive the menus of the day and make recently picked restaurants less likely (default: True)')
+def main(locations, location_file, workers, max_distance, time_of_day, ignore_rain, backend, timeout,
+         use_cache, refresh, use_history):
+    '''
+    Fetch LOCATIONS (address-city, e.g. kaivokatu-helsinki) through a shared pool of browsers and
+    HTTP connections, with one weather query per city, and print one result per office.
+    '''
+    locations = read_locations(locations, location_file)
+    if not locations:
+        raise click.UsageError('Give at least one location, as an argument or with --file')
+    for location in locations:
+        if '-' not in location:
+            raise click.BadParameter(f'{location}, expected format is <address>-<city>', param_hint='LOCATIONS')
+
+    # Offices in the same city share one forecast
+    cities = {location: location.split('-')[1] for location in locations}
+
+    with DriverPool(size = workers) as driver_pool, ThreadPoolExecutor(max_workers = workers) as executor:
+        weather_futures = {
+            city: executor.submit(fetch_weather, city, time_of_day, timeout, use_cache, refresh)
+            for city in dict.fromkeys(cities.values())
+        }
+        restaurant_futures = {
+            location: executor.submit(fetch_restaurants, location_url(location), timeout,
+                                      backend, use_cache, refresh, driver_pool, use_history)
+            for location in locations
+        }
+        wait([*weather_futures.values(), *restaurant_futures.values()])
+
+    failed = False
+    for location in locations:
+        print(f"===== {location} =====")
+        weather = None
+        weather_error = weather_futures[cities[location]].exception()
+        if weather_error is not None:
+            print(f"Weather could not be read: {weather_error}")
+        else:
+            weather = weather_futures[cities[location]].result()
+
+        restaurants = None
+        weights = None
+        restaurant_error = restaurant_futures[location].exception()
+        if restaurant_error is not None:
+            print(restaurant_error)
+            failed = True
+        else:
+            restaurants, backend_used = restaurant_futures[location].result()
+            restaurants = restaurants.within(max_distance)
+            print(f'Restaurants read: {len(restaurants)} in total (backend: {backend_used})')
+            restaurants = select_restaurants(restaurants, weather, max_distance, ignore_rain)
+            if not len(restaurants):
+                print(f'No restaurants within {max_distance} m')
+            elif use_history:
+                weights = pick_weights(location, restaurants)
+
+        restaurant = print_report(restaurants, weather, time_of_day, weights)
+        if use_history and restaurant is not None:
+            record_pick(location, restaurant[0])
+
+    if failed:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+'''
+On-disk cache for parsed restaurants and weather, so repeated runs skip the network.
+
+Entries are JSON files under CACHE_DIR/<kind>/, one per key. Writes go through a temporary
+file and os.replace, so concurrent lunchbot runs never see a half written entry.
+'''
+
+import datetime
+import json
+import os
+import tempfile
+import time
+from .profiling import count
+
+CACHE_DIR = os.environ.get('LUNCHBOT_CACHE_DIR') or os.path.join(
+    os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'), 'lunchbot')
+
+# Menus change at most once a day, the FMI forecast once an hour
+MENU_TTL = 24 * 60 * 60
+WEATHER_TTL = 60 * 60
+
+# Entries kept per kind before the least recently written ones are evicted
+MAX_ENTRIES = 256
+
+
+def _entry_path(kind: str, key: tuple) -> str:
+    name = '__'.join(str(part).lower().replace(os.sep, '_') for part in key)
+    return os.path.join(CACHE_DIR, kind, f'{name}.json')
+
+
+def menu_key(location: str, day: datetime.date | None = None) -> tuple:
+    '''Key for the restaurants of <location> on <day> (default: today).'''
+    return (location, (day or datetime.date.today()).isoformat())
+
+
+def weather_key(city: str, hour: datetime.datetime | None = None, hours: tuple | None = None) -> tuple:
+    '''
+    Key for the forecast of <city> issued during <hour> (default: the current hour), covering the
+    (first, last) hours of the day if given and the default window otherwise.
+    '''
+    key = (city, (hour or datetime.datetime.now()).strftime('%Y-%m-%dT%H'))
+    return key if hours is None else (*key, '{:02d}-{:02d}'.format(*hours))
+
+
+def read(kind: str, key: tuple, ttl: float):
+    '''
+    Return the cached value for <key>, or None if it's missing, older than ttl seconds or unreadable.
+    '''
+    path = _entry_path(kind, key)
+    try:
+        if time.time() - os.path.getmtime(path) > ttl:
+            count(f'cache_{kind}_misses')
+            return None
+        with open(path, encoding = 'utf-8') as f:
+            value = json.load(f)
+    except (OSError, ValueError):
+        count(f'cache_{kind}_misses')
+        return None
+    count(f'cache_{kind}_hits')
+    return value
+
+
+def written_at(kind: str, key: tuple) -> datetime.datetime | None:
+    '''When the entry for <key> was last written, or None if there is none.'''
+    try:
+        return datetime.datetime.fromtimestamp(os.path.getmtime(_entry_path(kind, key)))
+    except OSError:
+        return None
+
+
+def write(kind: str, key: tuple, value, max_entries: int = MAX_ENTRIES) -> None:
+    '''
+    Atomically store <value> (anything json serialisable) under <key>, then evict old entries.
+    '''
+    write_json(_entry_path(kind, key), value)
+    evict(kind, max_entries)
+
+
+def write_json(path: str, value) -> None:
+    '''
+    Write <value> as JSON to <path> through a temporary file, so readers never see it half written.
+    '''
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok = True)
+
+    fd, tmp_path = tempfile.mkstemp(dir = directory, prefix = '.', suffix = '.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding = 'utf-8') as f:
+            json.dump(value, f, ensure_ascii = False)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def evict(kind: str, max_entries: int = MAX_ENTRIES) -> None:
+    '''
+    Remove the least recently written entries of <kind> until at most max_entries remain.
+    '''
+    directory = os.path.join(CACHE_DIR, kind)
+    entries = []
+    with os.scandir(directory) as it:
+        for entry in it:
+            if not entry.name.endswith('.json'):
+                continue
+            try:
+                entries.append((entry.stat().st_mtime, entry.path))
+            except OSError:
+                pass  # Removed by a concurrent run
+
+    entries.sort()
+    for _, path in entries[:max(len(entries) - max_entries, 0)]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass  # Already evicted by a concurrent run
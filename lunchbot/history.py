@@ -0,0 +1,226 @@
+'''
+Archive of the restaurants and menus seen each day, and of the restaurants picked, per location.
+
+    HISTORY_DIR/<location>/<YYYY-MM-DD>.json      restaurants of the day, written once and never changed
+    HISTORY_DIR/<location>/index-<YYYY-MM>.json   the month's restaurants and the name and menu terms
+                                                  of each, with the days of the month they were seen on
+    HISTORY_DIR/<location>/picks.jsonl            one {"date", "name"} line per pick, appended
+
+Queries only read the month indexes their window covers and the pick log, never the daily
+partitions, so they stay fast however many months are archived, and archiving a day only
+rewrites the index of its month. Partitions and indexes are written atomically; two processes
+archiving the same location at the same moment may lose one of the index updates, which
+rebuild_index() repairs.
+'''
+
+import datetime
+import json
+import os
+import re
+import threading
+from bisect import insort
+from . import cache
+from .profiling import span
+import click
+
+HISTORY_DIR = os.environ.get('LUNCHBOT_HISTORY_DIR') or os.path.join(
+    os.environ.get('XDG_DATA_HOME') or os.path.expanduser('~/.local/share'), 'lunchbot', 'history')
+
+# Days a pick keeps lowering the odds of the same restaurant, see restaurant_for_the_day_lean
+REPEAT_WINDOW = 14
+
+_lock = threading.Lock()
+
+
+def _location_dir(location: str) -> str:
+    return os.path.join(HISTORY_DIR, location.lower().replace(os.sep, '_'))
+
+
+def terms(text: str) -> list:
+    '''Lower case words of <text> that can be searched for: numbers and words of two letters or more.'''
+    return [word for word in re.findall(r'\w+', text.lower()) if len(word) > 1 or word.isdigit()]
+
+
+def _read_index(location: str, month: str) -> dict:
+    try:
+        with open(os.path.join(_location_dir(location), f'index-{month}.json'), encoding = 'utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {'names': {}, 'terms': {}}
+
+
+def _add_to_index(index: dict, day: int, restaurants: list) -> None:
+    for restaurant in restaurants:
+        name = restaurant['name']
+        insort(index['names'].setdefault(name, []), day)
+        # Numbers in the menu are prices, not worth searching for
+        menu_terms = [term for term in terms(' '.join(restaurant['menu'])) if not term.isdigit()]
+        for term in dict.fromkeys([*terms(name), *menu_terms]):
+            insort(index['terms'].setdefault(term, {}).setdefault(name, []), day)
+
+
+def archive(location: str, restaurants, day: datetime.date | None = None) -> bool:
+    '''
+    Store the cleaned <restaurants> of <location> for <day> (default: today) and index them.
+    A day is archived once; returns False if it already was.
+    '''
+    day = day or datetime.date.today()
+    month = day.strftime('%Y-%m')
+    directory = _location_dir(location)
+    path = os.path.join(directory, f'{day.isoformat()}.json')
+    records = [{'name': setti[0], 'hours': setti[1], 'menu': list(setti[2:-1]), 'distance': setti[-1]}
+               for setti in restaurants]
+
+    with span('archive'), _lock:
+        if os.path.exists(path):
+            return False
+        cache.write_json(path, records)
+        index = _read_index(location, month)
+        _add_to_index(index, day.day, records)
+        cache.write_json(os.path.join(directory, f'index-{month}.json'), index)
+    return True
+
+
+def rebuild_index(location: str) -> None:
+    '''Index every archived day of <location> again, from the partitions.'''
+    directory = _location_dir(location)
+    indexes = {}
+    with _lock:
+        for entry in sorted(os.listdir(directory)):
+            if re.fullmatch(r'\d{4}-\d{2}-\d{2}\.json', entry):
+                index = indexes.setdefault(entry[:7], {'names': {}, 'terms': {}})
+                with open(os.path.join(directory, entry), encoding = 'utf-8') as f:
+                    _add_to_index(index, int(entry[8:10]), json.load(f))
+        for month, index in indexes.items():
+            cache.write_json(os.path.join(directory, f'index-{month}.json'), index)
+
+
+def locations() -> list:
+    '''Locations with anything archived.'''
+    try:
+        return sorted(entry.name for entry in os.scandir(HISTORY_DIR) if entry.is_dir())
+    except OSError:
+        return []
+
+
+def _since(days: int, today: datetime.date | None) -> datetime.date:
+    return (today or datetime.date.today()) - datetime.timedelta(days = days - 1)
+
+
+def _month_indexes(location: str, since: datetime.date, until: datetime.date):
+    '''(month, first day, last day, index) of each month from since to until, cut to the window.'''
+    month = since.replace(day = 1)
+    while month <= until:
+        key = month.strftime('%Y-%m')
+        first = since.day if key == since.strftime('%Y-%m') else 1
+        last = until.day if key == until.strftime('%Y-%m') else 31
+        yield key, first, last, _read_index(location, key)
+        month = (month + datetime.timedelta(days = 32)).replace(day = 1)
+
+
+def appearances(query: str, days: int = 90, location: str | None = None, today: datetime.date | None = None) -> list:
+    '''
+    Where <query> (a restaurant name or words of a menu) appeared in the last <days> days,
+    as (date, location, restaurant) tuples, oldest first. Every word of the query has to match.
+    '''
+    words = terms(query)
+    if not words:
+        return []
+    today = today or datetime.date.today()
+    found = []
+    for place in [location] if location else locations():
+        for month, first, last, index in _month_indexes(place, _since(days, today), today):
+            matches = None
+            for word in words:
+                seen = {(day, name) for name, seen_on in index['terms'].get(word, {}).items()
+                        for day in seen_on if first <= day <= last}
+                matches = seen if matches is None else matches & seen
+            found.extend((f'{month}-{day:02d}', place, name) for day, name in matches)
+    return sorted(found)
+
+
+def record_pick(location: str, name: str, day: datetime.date | None = None) -> None:
+    '''Log <name> as the restaurant picked at <location> on <day> (default: today).'''
+    directory = _location_dir(location)
+    os.makedirs(directory, exist_ok = True)
+    line = json.dumps({'date': (day or datetime.date.today()).isoformat(), 'name': name}, ensure_ascii = False)
+    with _lock, open(os.path.join(directory, 'picks.jsonl'), 'a', encoding = 'utf-8') as f:
+        f.write(line + '\n')
+
+
+def picks(location: str, days: int = REPEAT_WINDOW, today: datetime.date | None = None) -> list:
+    '''(date, restaurant) of the picks at <location> in the last <days> days, oldest first.'''
+    since = _since(days, today).isoformat()
+    found = []
+    try:
+        with open(os.path.join(_location_dir(location), 'picks.jsonl'), encoding = 'utf-8') as f:
+            for line in f:
+                try:
+                    pick = json.loads(line)
+                    day, name = datetime.date.fromisoformat(pick['date']).isoformat(), str(pick['name'])
+                except (ValueError, TypeError, KeyError):
+                    continue  # Line cut short by a crash, or not a pick
+                if day >= since:
+                    found.append((day, name))
+    except OSError:
+        pass
+    return sorted(found)
+
+
+def days_since_picked(location: str, days: int = REPEAT_WINDOW, today: datetime.date | None = None) -> dict:
+    '''{restaurant: days since it was last picked} for the restaurants picked in the last <days> days.'''
+    today = today or datetime.date.today()
+    return {name: (today - datetime.date.fromisoformat(day)).days for day, name in picks(location, days, today)}
+
+
+def pick_weights(location: str, restaurants, window: int = REPEAT_WINDOW,
+                 today: datetime.date | None = None) -> list:
+    '''
+    Weight of each of <restaurants> in the pick of the day at <location>: 1, or (days since
+    picked + 1) / (window + 1) for the ones picked in the last <window> days, so today's pick is
+    the least likely and yesterday's the second least.
+    '''
+    since = days_since_picked(location, window, today)
+    return [(min(since.get(setti[0], window), window) + 1) / (window + 1) for setti in restaurants]
+
+
+def not_visited(location: str, days: int = 7, today: datetime.date | None = None) -> list:
+    '''Restaurants archived for <location> in the last <days> days that weren't picked in that time.'''
+    today = today or datetime.date.today()
+    seen = {name for _, first, last, index in _month_indexes(location, _since(days, today), today)
+            for name, seen_on in index['names'].items() if any(first <= day <= last for day in seen_on)}
+    picked = {name for _, name in picks(location, days, today)}
+    return sorted(seen - picked)
+
+
+@click.group()
+def main():
+    '''
+    Query the archive of restaurants and menus seen and picked by lunchbot.
+    '''
+
+
+@main.command()
+@click.argument('query')
+@click.option('--days', type=int, default=90, help='How many days back to look (default: 90)')
+@click.option('--location', type=str, default=None, help='Only look at this location (default: all)')
+def appeared(query, days, location):
+    '''
+    Where QUERY, a restaurant name or words of a menu, appeared in the last --days days.
+    '''
+    for day, place, name in appearances(query, days, location):
+        print(f'{day}  {place}  {name}')
+
+
+@main.command('not-visited')
+@click.argument('location')
+@click.option('--days', type=int, default=7, help='How many days back to look (default: 7)')
+def not_visited_command(location, days):
+    '''
+    Restaurants seen at LOCATION in the last --days days that weren't picked.
+    '''
+    for name in not_visited(location, days):
+        print(name)
+
+if __name__ == '__main__':
+    main()
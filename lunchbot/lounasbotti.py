@@ -2,78 +2,309 @@
 Prints the restaurant for today with weather and whether it's terrace_weather or not
 '''
 
-from .restaurant_scraper import *
-from .weather import *
+from concurrent.futures import Future, wait
+from .restaurant_scraper import (BACKENDS, Restaurants, clean_menu_records, fetch_menu_records, location_url,
+                                 restaurant_for_the_day_lean)
+from .weather import (forecast_window, forecasts, get_current_and_next_hour_data, get_parameter_value, index_weather,
+                      index_weather_lean, terrace_weather_by_hour, terrace_weather_lean, weather_from_records)
+from . import cache, history, profiling
+from .profiling import span
 import click
+import json
+import sys
+import threading
+
+# Seconds the weather and restaurant stages get before they are given up on
+FETCH_TIMEOUT = 60
+
+
+def fetch_weather_index(city, timeout = None, use_cache = True, refresh = False, lean = False, hours = None):
+    '''
+    Fetch the forecast for <city> and pivot it into a weather index, see index_weather,
+    or index_weather_lean if lean is set.
+    hours = (first, last) fetches only those hours of the day (UTC, like the index) instead of
+    08:00 to 12 hours from now. Hours this process already holds are reused, see weather.ForecastStore.
+    The parsed forecast is cached per city and hour; refresh skips reading the cache.
+    '''
+    key = cache.weather_key(city, hours = hours)
+    records = cache.read('weather', key, cache.WEATHER_TTL) if use_cache and not refresh else None
+    if records is None:
+        with span('get_forecast'):
+            records = forecasts.records(city, *forecast_window(*(hours or ())), timeout = timeout, refresh = refresh)
+        if use_cache:
+            cache.write('weather', key, records)
+
+    # Pivot once, every lookup after this is a plain index access
+    with span('index_weather'):
+        return index_weather_lean(records) if lean else index_weather(weather_from_records(records))
+
+
+def summarize_weather(weather_index, time_of_day):
+    '''
+    Read the values printed for time_of_day and the hour after it from the weather index.
+    '''
+    if isinstance(weather_index, dict):
+        current_hour_data, next_hour_data = weather_index[time_of_day], weather_index[time_of_day + 1]
+        terrace = {time_of_day: terrace_weather_lean(current_hour_data, min_temp = 20),
+                   time_of_day + 1: terrace_weather_lean(next_hour_data, min_temp = 20)}
+    else:
+        terrace = terrace_weather_by_hour(weather_index, min_temp = 20)
+
+        # Get current and next hour weather data
+        current_hour_data, next_hour_data = get_current_and_next_hour_data(weather_index, time_of_day)
+
+    # Extract relevant weather parameters
+    return {
+        'temperature_now': get_parameter_value(current_hour_data, 'Temperature'),
+        'rain_now': get_parameter_value(current_hour_data, 'PrecipitationAmount'),
+        'temp_in_an_hour': get_parameter_value(next_hour_data, 'Temperature'),
+        'rain_in_an_hour': get_parameter_value(next_hour_data, 'PrecipitationAmount'),
+        'terrace_now': bool(terrace[time_of_day]),
+        'terrace_in_an_hour': bool(terrace[time_of_day + 1]),
+    }
+
+
+def fetch_weather(city, time_of_day, timeout = None, use_cache = True, refresh = False, lean = False):
+    '''
+    Fetch the forecast for <city> and read the values printed for time_of_day and the hour after it.
+    '''
+    weather_index = fetch_weather_index(city, timeout, use_cache, refresh, lean, hours = (time_of_day, time_of_day + 1))
+    return summarize_weather(weather_index, time_of_day)
+
+
+def fetch_restaurants(url, timeout = None, backend = 'auto', use_cache = True, refresh = False, driver_pool = None,
+                      use_history = True):
+    '''
+    Scrape, clean and sort the restaurants listed at <url>.
+    Returns them as Restaurants and the name of the backend that served the page ('cache' if none did).
+    The cleaned restaurants are cached per location and day; refresh skips reading the cache.
+    With use_history the day's restaurants are also archived, see history.archive; a failure
+    to archive is printed and doesn't cost the scrape.
+    '''
+    location = url.split('/')[-1]
+    key = cache.menu_key(location)
+    restaurants = cache.read('menus', key, cache.MENU_TTL) if use_cache and not refresh else None
+    if restaurants is not None:
+        backend = 'cache'
+    else:
+        with span('get_menu_list'):
+            records, backend = fetch_menu_records(url, timeout = timeout, backend = backend, driver_pool = driver_pool)
+        with span('clean_menu_list'):
+            restaurants = clean_menu_records(records)
+        if use_cache:
+            cache.write('menus', key, restaurants)
+    if use_history:
+        try:
+            history.archive(location, restaurants)
+        except OSError as error:
+            print(f'Restaurants not archived: {error}')
+    return Restaurants.from_cleaned(restaurants), backend
+
+
+def pick_weights(location, restaurants):
+    '''
+    history.pick_weights for <restaurants>, or None, an even pick, if the history can't be read.
+    '''
+    try:
+        return history.pick_weights(location, restaurants)
+    except OSError as error:
+        print(f'History could not be read: {error}')
+        return None
+
+
+def record_pick(location, name):
+    '''
+    history.record_pick, printing rather than raising if the history can't be written.
+    '''
+    try:
+        history.record_pick(location, name)
+    except OSError as error:
+        print(f'Pick not recorded: {error}')
+
+
+def _run_stage(name, function, *args):
+    # Worker threads don't inherit the main thread's open spans, so each stage is a span of its own
+    with span(name):
+        return profiling.run_profiled(function, *args)
+
+
+def _start_stage(name, function, *args):
+    # A running thread can't be cancelled, so stages run on daemon threads: one that overruns the
+    # deadline is left behind and dies with the process instead of keeping it alive until it's done
+    future = Future()
+
+    def run():
+        try:
+            future.set_result(_run_stage(name, function, *args))
+        except BaseException as error:
+            future.set_exception(error)
+
+    threading.Thread(target = run, name = f'lunchbot-{name}', daemon = True).start()
+    return future
+
+
+def fetch_concurrently(city, url, time_of_day, timeout = FETCH_TIMEOUT, backend = 'auto',
+                       use_cache = True, refresh = False, lean = False, use_history = True):
+    '''
+    Run the weather query and the restaurant scrape side by side.
+
+    Both stages share one deadline of <timeout> seconds, which is also passed down as the
+    network / page load timeout. A stage that raises, or hasn't finished by the deadline, is
+    reported as failed and the other stage's result is kept. A late stage can't be stopped:
+    it keeps running on its daemon thread, and is dropped when the process exits.
+
+    Returns:
+    (weather, restaurants, errors) where restaurants is (restaurants, backend), a failed
+    stage's result is None and errors maps the stage name ('weather' or 'restaurants') to its exception.
+    '''
+    futures = {
+        'weather': _start_stage('weather', fetch_weather, city, time_of_day, timeout, use_cache, refresh, lean),
+        'restaurants': _start_stage('restaurants', fetch_restaurants, url, timeout, backend, use_cache, refresh,
+                                    None, use_history),
+    }
+    done, _ = wait(futures.values(), timeout = timeout)
+
+    results = {}
+    errors = {}
+    for stage, future in futures.items():
+        results[stage] = None
+        if future not in done:
+            errors[stage] = TimeoutError(f'{stage} not fetched within {timeout} seconds')
+        elif future.exception() is not None:
+            errors[stage] = future.exception()
+        else:
+            results[stage] = future.result()
+
+    return results['weather'], results['restaurants'], errors
+
+
+def select_restaurants(restaurants, weather, max_distance, ignore_rain):
+    '''
+    Keep the Restaurants within max_distance, or only the 5 closest of those if it's raining and you mind.
+    '''
+    restaurants = restaurants.within(max_distance)
+
+    # If it's raining, and you mind, limit restaurant selection to 5 closest
+    if weather is not None and weather['rain_now'] >= 1.0 and not ignore_rain:
+        restaurants = restaurants.nearest(5)
+    return restaurants
+
+
+def print_report(restaurants, weather, time_of_day, weights = None):
+    '''
+    Print the pick of the day and the weather, skipping whichever of the two is missing or,
+    for the restaurants, empty.
+    The pick is weighted by <weights>, see history.pick_weights. Returns the restaurant picked, if any.
+    '''
+    restaurant = None
+
+    # Print the information and copypaste to Slack
+    print(":robot_face:Lounasbotti tiedottaa:robot_face:\n")
+    if restaurants is not None and len(restaurants):
+        restaurant = restaurant_for_the_day_lean(restaurants, weights)
+        restaurant_name, menu, distance = restaurant[0], restaurant[2:-1], restaurant[-1]
+
+        if distance >= 1000:
+            print(f"Päivän ravintolana toimii {restaurant_name}, n. {distance / 1000} kilometrin päässä\n")
+        else:
+            print(f"Päivän ravintolana toimii {restaurant_name}, n. {distance} metrin päässä\n")
+        print("Luvassa on:\n")
+        for setti in menu:
+            print(setti)
+        print("\n")
+    if weather is not None:
+        print(f"Lämpötila nyt: {weather['temperature_now']}")
+        print(f"Sade nyt: {weather['rain_now']}")
+        print(f"Lämpötila klo {time_of_day + 1}: {weather['temp_in_an_hour']}")
+        print(f"Sade klo {time_of_day + 1}: {weather['rain_in_an_hour']}")
+        print(f"Terassikeli nyt: {weather['terrace_now']}")
+        print(f"Terassikeli klo {time_of_day + 1}: {weather['terrace_in_an_hour']}")
+    return restaurant
 
 
 @click.command()
-@click.option('--location', type=str, default='vallihaudankatu-turku', 
+@click.option('--location', type=str, default='vallihaudankatu-turku',
               help='Specify the location (default: vallihaudankatu-turku)')
-@click.option('--max_distance', type=int, default=500, 
+@click.option('--max_distance', type=int, default=500,
               help='Specify the maximum distance in meters (default: 500)')
-@click.option('--time_of_day', type=int, default=11, 
+@click.option('--time_of_day', type=int, default=11,
               help='Specify the time of day in hours (default: 11)')
 @click.option('--ignore_rain/--no-ignore_rain', default=False,
               help='Specify whether to ignore rain (default: False)')
-def main(location, max_distance, time_of_day, ignore_rain):
-    
+@click.option('--backend', type=click.Choice(['auto', *BACKENDS]), default='auto',
+              help='Scraping backend, auto falls back to selenium if plain HTTP finds nothing (default: auto)')
+@click.option('--timeout', type=float, default=FETCH_TIMEOUT,
+              help=f'Seconds to wait for weather and menus before giving up (default: {FETCH_TIMEOUT})')
+@click.option('--cache/--no-cache', 'use_cache', default=True,
+              help='Reuse menus fetched today and the forecast fetched this hour (default: True)')
+@click.option('--refresh', is_flag=True, default=False,
+              help='Fetch everything again and update the cache')
+@click.option('--history/--no-history', 'use_history', default=True,
+              help='Archive the menus of the day and make recently picked restaurants less likely (default: True)')
+@click.option('--lean', is_flag=True, default=False,
+              help='Look up the weather on plain Python structures without loading pandas')
+@click.option('--profile', type=click.Choice(['text', 'json']), is_flag=False, flag_value='text', default=None,
+              help='Print a timing breakdown of the run to stderr, as a table (default) or JSON')
+@click.option('--cprofile', 'cprofile_path', type=click.Path(dir_okay=False, writable=True), default=None,
+              help='Dump cProfile stats of the run to this file, read them with python -m pstats')
+def main(location, max_distance, time_of_day, ignore_rain, backend, timeout, use_cache, refresh, use_history, lean,
+         profile, cprofile_path):
+    if profile is not None:
+        profiling.enable()
+    try:
+        with profiling.cprofile(cprofile_path), span('main'):
+            run(location, max_distance, time_of_day, ignore_rain, backend, timeout, use_cache, refresh, use_history,
+                lean)
+    finally:
+        if profile == 'json':
+            click.echo(json.dumps(profiling.report(), indent = 2), err = True)
+        elif profile == 'text':
+            click.echo(profiling.format_report(), err = True)
 
-    time_of_day = time_of_day
-    max_distance = max_distance
-    location = location
+
+def run(location, max_distance, time_of_day, ignore_rain, backend, timeout, use_cache, refresh, use_history, lean):
+    '''
+    Fetch, pick and print the restaurant and weather of the day, see main for the arguments.
+    '''
     city = location.split('-')[1]
-    ignore_rain = ignore_rain
 
-    URL = f"https://www.lounaat.info/{location}"
+    URL = location_url(location)
 
-    # Get weather data
+    # Weather and restaurants don't depend on each other, so fetch them side by side
     print('Reading weather...')
-    weather_data = get_weather_data(n_hours = 12, city = city)
-    print('Weather read.')
-
-    # Get current and next hour weather data
-    current_hour_data, next_hour_data = get_current_and_next_hour_data(weather_data, time_of_day)
-
-    # Extract relevant weather parameters
-    temperature_now = get_parameter_value(current_hour_data, 'Temperature')
-    rain_now = get_parameter_value(current_hour_data, 'PrecipitationAmount')
-    temp_in_an_hour = get_parameter_value(next_hour_data, 'Temperature')
-    rain_in_an_hour = get_parameter_value(next_hour_data, 'PrecipitationAmount')
-
-    # Fetch restaurant data
     print(f'Reading restaurants from {URL}')
-    restaurant_df = create_df(clean_menu_list(get_menu_list(URL)))
-    restaurant_df = restaurant_df.sort_values(by = ['Etäisyys'])
-    restaurant_df = restaurant_df[restaurant_df['Etäisyys'] <= max_distance]
-    print(f'Restaurants read: {len(restaurant_df)} in total')
+    weather, fetched, errors = fetch_concurrently(city, URL, time_of_day, timeout = timeout, backend = backend,
+                                                  use_cache = use_cache, refresh = refresh, lean = lean,
+                                                  use_history = use_history)
+    restaurants = None
+    weights = None
 
-    # If it's raining, and you mind, limit restaurant selection to 5 closest
-    if rain_now >= 1.0 and not ignore_rain:
-        restaurant_df = restaurant_df.head(5)
+    if 'weather' in errors:
+        print(f"Weather could not be read: {errors['weather']}")
+    else:
+        print('Weather read.')
 
-    restaurant = restaurant_for_the_day(restaurant_df)
+    if 'restaurants' in errors:
+        print(errors['restaurants'])
+    else:
+        restaurants, backend = fetched
+        with span('select_restaurants'):
+            # Counted within max_distance, before any cut for rain
+            restaurants = restaurants.within(max_distance)
+            print(f'Restaurants read: {len(restaurants)} in total (backend: {backend})')
+            restaurants = select_restaurants(restaurants, weather, max_distance, ignore_rain)
+        if not len(restaurants):
+            print(f'No restaurants within {max_distance} m')
+        elif use_history:
+            weights = pick_weights(location, restaurants)
 
-    restaurant_name = restaurant['Ravintola'].values[0]
-    menu = restaurant['Menu'].values[0]
-    distance = restaurant['Etäisyys'].values[0]
+    with span('print_report'):
+        restaurant = print_report(restaurants, weather, time_of_day, weights)
+    if use_history and restaurant is not None:
+        record_pick(location, restaurant[0])
 
-    # Print the information and copypaste to Slack
-    print(":robot_face:Lounasbotti tiedottaa:robot_face:\n")
-    if distance >= 1000:
-        print(f"Päivän ravintolana toimii {restaurant_name}, n. {distance / 1000} kilometrin päässä\n")
-    else:
-        print(f"Päivän ravintolana toimii {restaurant_name}, n. {distance} metrin päässä\n")
-    print("Luvassa on:\n")
-    for setti in menu:
-        print(setti)
-    print("\n")
-    print(f"Lämpötila nyt: {temperature_now}")
-    print(f"Sade nyt: {rain_now}")
-    print(f"Lämpötila klo {time_of_day + 1}: {temp_in_an_hour}")
-    print(f"Sade klo {time_of_day + 1}: {rain_in_an_hour}")
-    print(f"Terassikeli nyt: {terrace_weather(df = current_hour_data, min_temp = 20)}")
-    print(f"Terassikeli klo {time_of_day + 1}: {terrace_weather(df = next_hour_data, min_temp = 20)}")
+    if 'restaurants' in errors:
+        sys.exit(1)
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
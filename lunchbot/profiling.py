@@ -0,0 +1,163 @@
+'''
+Span timers and counters for finding out where a run spends its time.
+
+Recording is off until enable() is called, after which
+
+    with span('page_load'):
+        driver.get(url)
+    count('elements_scanned', len(divs))
+
+are collected from every thread. Spans nest per thread, so a span opened inside another is
+reported as parent/child. report() summarises everything as a dict, format_report() as text.
+'''
+
+import contextlib
+import cProfile
+import sys
+import threading
+import time
+
+_lock = threading.Lock()
+_local = threading.local()
+_enabled = False
+_spans = {}         # name -> [calls, total seconds, min seconds, max seconds, first start]
+_counters = {}
+_profilers = None   # cProfile.Profile per thread while a cprofile() dump is active
+_started = time.perf_counter()
+
+# From Python 3.12 on only one profiler can be active at a time, and it sees every thread
+_SINGLE_PROFILER = sys.version_info >= (3, 12)
+
+
+def enable():
+    '''Start recording, dropping anything recorded before.'''
+    global _enabled, _started
+    with _lock:
+        _spans.clear()
+        _counters.clear()
+        _started = time.perf_counter()
+        _enabled = True
+
+
+def enabled():
+    return _enabled
+
+
+@contextlib.contextmanager
+def span(name):
+    '''Time the block under <name>, nested in the span the current thread has open, if any.'''
+    if not _enabled:
+        yield
+        return
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    stack.append(name)
+    path = '/'.join(stack)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        stack.pop()
+        with _lock:
+            stats = _spans.get(path)
+            if stats is None:
+                _spans[path] = [1, elapsed, elapsed, elapsed, start - _started]
+            else:
+                stats[0] += 1
+                stats[1] += elapsed
+                stats[2] = min(stats[2], elapsed)
+                stats[3] = max(stats[3], elapsed)
+
+
+def count(name, amount = 1):
+    '''Add <amount> to the counter <name>.'''
+    if not _enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+
+def report():
+    '''
+    Everything recorded so far: {'spans': {path: {calls, total_ms, min_ms, max_ms, start_ms}}, 'counters': {...}},
+    spans in the order they were first opened, each directly followed by its children.
+    '''
+    def tree_order(item):
+        path, stats = item
+        parts = path.split('/')
+        prefixes = ('/'.join(parts[:i]) for i in range(1, len(parts) + 1))
+        return tuple(_spans[prefix][4] if prefix in _spans else stats[4] for prefix in prefixes)
+
+    with _lock:
+        spans = sorted(_spans.items(), key = tree_order)
+        counters = dict(_counters)
+    return {
+        'spans': {path: {'calls': calls, 'total_ms': total * 1000, 'min_ms': low * 1000, 'max_ms': high * 1000,
+                         'start_ms': start * 1000}
+                  for path, (calls, total, low, high, start) in spans},
+        'counters': counters,
+    }
+
+
+def format_report(recorded = None):
+    '''The report as an indented table of spans followed by the counters.'''
+    recorded = recorded or report()
+    lines = [f"{'span':<48} {'calls':>6} {'total ms':>10} {'start ms':>10}"]
+    for path, stats in recorded['spans'].items():
+        depth = path.count('/')
+        name = '  ' * depth + path.rsplit('/', 1)[-1]
+        lines.append(f"{name:<48} {stats['calls']:>6} {stats['total_ms']:>10.1f} {stats['start_ms']:>10.1f}")
+    if recorded['counters']:
+        lines.append('')
+        lines.append(f"{'counter':<48} {'value':>6}")
+        for name, value in recorded['counters'].items():
+            lines.append(f'{name:<48} {value:>6}')
+    return '\n'.join(lines)
+
+
+def run_profiled(function, *args, **kwargs):
+    '''
+    Call function(*args, **kwargs), under cProfile if a cprofile() dump is active.
+    Before Python 3.12 cProfile only sees the thread it runs in, so worker threads run their stages
+    through this; from 3.12 on the profiler of cprofile() covers them already.
+    '''
+    if _profilers is None or _SINGLE_PROFILER:
+        return function(*args, **kwargs)
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(function, *args, **kwargs)
+    finally:
+        with _lock:
+            if _profilers is not None:
+                _profilers.append(profiler)
+
+
+@contextlib.contextmanager
+def cprofile(path):
+    '''
+    Profile the block, and every run_profiled call inside it, with cProfile and dump the merged
+    stats to <path> (read them with python -m pstats <path>). Does nothing if path is None.
+    '''
+    global _profilers
+    if path is None:
+        yield
+        return
+    profiler = cProfile.Profile()
+    _profilers = [profiler]
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        with _lock:
+            profilers, _profilers = _profilers, None
+        import pstats
+
+        for each in profilers:
+            each.create_stats()
+        stats = pstats.Stats(profilers[0])
+        for other in profilers[1:]:
+            stats.add(other)
+        stats.dump_stats(path)
@@ -1,56 +1,360 @@
 '''
 Scrapes https://www.lounaat.info/<address-city> for lunch menus of today. 
 '''
-import pandas as pd
+import queue
+import random
+import threading
 
-import sys
-from selenium.webdriver.common.by import By
-from selenium.webdriver.chrome.options import Options
-from selenium import webdriver
-from selenium.webdriver.common.keys import Keys
-from selenium.webdriver.common.action_chains import ActionChains
+from array import array
+from bisect import bisect_right
+from contextlib import contextmanager
+from html.parser import HTMLParser
+from .profiling import count, span
+from .session import get_session
+
+# pandas, requests and selenium are imported by the backends that use them, so the CLI starts without them
+
+# Site the menus are scraped from, one page per <address-city>
+LOUNAAT_URL = 'https://www.lounaat.info'
+
+# Scraping backends in the order 'auto' tries them
+BACKENDS = ('http', 'selenium')
+
+# lounaat.info serves the menus only to browser-like clients
+HTTP_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/129.0 Safari/537.36',
+    'Accept-Language': 'fi-FI,fi;q=0.9',
+}
+
+class DriverPool:
+    '''
+    Bounded pool of reusable headless Chrome sessions for scraping several locations.
+
+    At most <size> browsers are started, lazily, and each is handed to one caller at a time.
+    A browser whose caller raised is quit rather than handed out again, and replaced on demand.
+    Use as a context manager, or call close(), so every browser is quit even on errors.
+    '''
+
+    def __init__(self, size = 2):
+        self.size = size
+        self._slots = threading.BoundedSemaphore(size)
+        self._idle = queue.Queue()
+        self._drivers = list()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def driver(self):
+        '''
+        Borrow a driver. Yields (driver, first_use); first_use is True for a browser
+        that hasn't loaded a page successfully yet and so still shows the cookie banner.
+        '''
+        # One slot per borrower, so a browser is only started when all <size> are lent out or gone
+        with self._slots:
+            first_use = False
+            try:
+                driver = self._idle.get_nowait()
+            except queue.Empty:
+                driver = _start_chrome()
+                with self._lock:
+                    self._drivers.append(driver)
+                first_use = True
+            try:
+                yield driver, first_use
+            except BaseException:
+                # A crashed browser, or one stuck on a timed out page load, is no use to the next caller
+                self._discard(driver)
+                raise
+            self._idle.put(driver)
+
+    def _discard(self, driver):
+        with self._lock:
+            if driver in self._drivers:
+                self._drivers.remove(driver)
+        try:
+            driver.quit()
+        except Exception:
+            pass  # Already gone, nothing left to clean up
+
+    def close(self):
+        with self._lock:
+            drivers, self._drivers = self._drivers, list()
+        for driver in drivers:
+            try:
+                driver.quit()
+            except Exception:
+                pass  # Already gone, nothing left to clean up
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def location_url(location):
+    '''
+    URL of the lounaat.info page of <location> (address-city).
+    '''
+    return f"{LOUNAAT_URL}/{location}"
+
+
+def get_menu_list(url, timeout = None, backend = 'auto'):
+    '''
+    Scrape the menu divs of <url>, one text blob per restaurant. See fetch_menu_records.
+    '''
+    result_list, _ = fetch_menu_list(url, timeout = timeout, backend = backend)
+    return result_list
+
+
+def fetch_menu_list(url, timeout = None, backend = 'auto', driver_pool = None):
+    '''
+    fetch_menu_records with each restaurant as one text blob, the format clean_menu_list expects.
+    '''
+    records, backend = fetch_menu_records(url, timeout = timeout, backend = backend, driver_pool = driver_pool)
+    return [menu_text(record) for record in records], backend
+
+
+def fetch_menu_records(url, timeout = None, backend = 'auto', driver_pool = None):
+    '''
+    Scrape the restaurants of <url> with the given backend, see menu_record for the records.
+
+    Parameters:
+    url (str): lounaat.info page of the location.
+    timeout (float): Seconds to wait for the page before giving up.
+    backend (str): 'http' parses the plain page, 'selenium' renders it in headless Chrome
+    and 'auto' tries them in the order of BACKENDS until one finds restaurants.
+    driver_pool (DriverPool): Browsers for the selenium backend to reuse, a new one is started if None.
+
+    Returns:
+    (records, backend) where backend is the name of the backend that served the request.
+    Raises ValueError if no restaurants are found.
+    '''
+    scrapers = {'http': _http_menu_records, 'selenium': _selenium_menu_records}
+    names = BACKENDS if backend == 'auto' else (backend,)
+
+    result_list = list()
+    for name in names:
+        try:
+            with span(name):
+                result_list = scrapers[name](url, timeout, driver_pool)
+        except Exception as error:
+            # Only give up on the last backend, 'auto' falls through to the next one
+            if name == names[-1]:
+                raise
+            print(f'Backend {name} failed ({error}), trying the next one')
+            continue
+        if result_list:
+            break
+
+    # Check if result_list is empty and raise with an error message if true
+    if not result_list:
+        raise ValueError(f"Error: No restaurants found, check input; perhaps the location ({url.split('/')[-1]}) you've provided is incorrect?\nExpected format is <address>-<city>")
+
+    return result_list, name
+
+
+class MenuHTMLParser(HTMLParser):
+    '''
+    Collects the text of every 'menu item category' div, one line per block element,
+    roughly the way Selenium's element.text renders it.
+    '''
+    BLOCK_TAGS = {'div', 'p', 'li', 'ul', 'ol', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'br', 'tr', 'table', 'section'}
+    SKIP_TAGS = {'script', 'style', 'noscript', 'template'}
+
+    def __init__(self):
+        super().__init__(convert_charrefs = True)
+        self.result_list = list()
+        self._depth = 0     # nesting of divs inside the current menu div, 0 when outside
+        self._skip = 0
+        self._lines = list()
+        self._line = ''
+
+    def _flush(self):
+        if self._line.strip():
+            self._lines.append(' '.join(self._line.split()))
+        self._line = ''
+
+    def handle_starttag(self, tag, attrs):
+        if self._depth == 0:
+            if tag == 'div' and 'menu item category' in (dict(attrs).get('class') or ''):
+                self._depth = 1
+                self._lines = list()
+                self._line = ''
+            return
+        if tag in self.SKIP_TAGS:
+            self._skip += 1
+        if tag == 'div':
+            self._depth += 1
+        if tag in self.BLOCK_TAGS:
+            self._flush()
+
+    def handle_endtag(self, tag):
+        if self._depth == 0:
+            return
+        if tag in self.SKIP_TAGS and self._skip:
+            self._skip -= 1
+        if tag in self.BLOCK_TAGS:
+            self._flush()
+        if tag == 'div':
+            self._depth -= 1
+            if self._depth == 0:
+                self.result_list.append('\n'.join(self._lines))
+
+    def handle_data(self, data):
+        if self._depth and not self._skip:
+            self._line += data
+
+
+def menu_record(text):
+    '''
+    Structure the text of one menu div into {'name', 'hours', 'menu', 'distance'}.
+
+    Rating lines (a digit and a '/') are dropped; of the rest the first line is the name,
+    the second the opening hours, the last the distance and the ones between the menu.
+    MENU_RECORDS_JS applies the same rules in the page. Returns None for a div with fewer than two lines.
+    '''
+    lines = [line.strip() for line in text.split('\n')]
+    lines = [line for line in lines if line and not (any(char.isdigit() for char in line) and '/' in line)]
+    if len(lines) < 2:
+        return None
+    return {'name': lines[0], 'hours': lines[1], 'menu': lines[2:-1], 'distance': lines[-1]}
+
+
+def menu_text(record):
+    '''
+    The record as the text blob of its menu div, without ratings.
+    '''
+    return '\n'.join([record['name'], record['hours'], *record['menu'], record['distance']])
+
+
+def parse_menu_html(html):
+    '''
+    Parse the restaurant blobs out of a lounaat.info page, same format as the Selenium backend.
+    '''
+    parser = MenuHTMLParser()
+    parser.feed(html)
+    parser.close()
+    return parser.result_list
+
+
+def _http_menu_records(url, timeout = None, driver_pool = None):
+    with span('http_get'):
+        response = get_session().get(url, headers = HTTP_HEADERS, timeout = timeout)
+        response.raise_for_status()
+    # Without a charset requests decodes text/html as ISO-8859-1, which mangles ä, å and €
+    if 'charset' not in response.headers.get('Content-Type', '').lower():
+        response.encoding = 'utf-8'
+    count('menu_bytes', len(response.content))
+    with span('parse_html'):
+        records = (menu_record(text) for text in parse_menu_html(response.text))
+        return [record for record in records if record is not None]
+
+
+def _start_chrome():
+    from selenium import webdriver
+    from selenium.webdriver.chrome.options import Options
 
-def get_menu_list(url):
     # Create ChromeOptions object to set up headless browsing
     chrome_options = Options()
     chrome_options.add_argument("--headless")  # Enable headless mode
-    driver = webdriver.Chrome(options = chrome_options)
-    driver.get(url)
+    return webdriver.Chrome(options = chrome_options)
 
 
-    # number of times to press TAB. This is used to navigate through cookies on the site
-    N = 3  
+def _selenium_menu_records(url, timeout = None, driver_pool = None):
+    if driver_pool is not None:
+        with driver_pool.driver() as (driver, first_use):
+            return _scrape_menu_records(driver, url, timeout, accept_cookies = first_use)
 
-    actions = ActionChains(driver) 
-    for _ in range(N):
-        actions = actions.send_keys(Keys.TAB)
+    with span('chrome_start'):
+        driver = _start_chrome()
+    try:
+        return _scrape_menu_records(driver, url, timeout)
+    finally:
+        driver.quit()
 
-    # Accept cookies
-    actions = actions.send_keys(Keys.ENTER)
-    actions.perform()
 
-    # Get more restaurants by clicking 'See More'. This is somehow broken but it also isn't that important.
-    #driver.find_element(By.CLASS_NAME, 'more.content').click()
-    #time.sleep(2)
-    #driver.find_element(By.CLASS_NAME, 'more.content').click()
-    #time.sleep(2)
+# Menu divs are the ones whose class contains 'menu item category'
+MENU_DIVS_CSS = 'div[class*="menu item category"]'
 
-    restaurant_divs = driver.find_elements(By.XPATH, "//div[contains(text(), menu.item.category-)]")
+# Runs in the page and structures every menu div in one pass, with the same rules as menu_record
+MENU_RECORDS_JS = f'''
+const records = [];
+for (const div of document.querySelectorAll('{MENU_DIVS_CSS}')) {{
+    const lines = div.innerText.split('\\n').map(line => line.trim())
+        .filter(line => line && !(/\\d/.test(line) && line.includes('/')));
+    if (lines.length < 2) continue;
+    records.push({{name: lines[0], hours: lines[1], menu: lines.slice(2, -1), distance: lines[lines.length - 1]}});
+}}
+return {{scanned: document.getElementsByTagName('div').length, records: records}};
+'''
 
-    # Create an empty list to store the text or attributes of the child divs
-    result_list = list()
+# Clicks 'See more' if it's showing and returns the number of menu divs before the click, else null
+CLICK_MORE_JS = f'''
+const more = document.querySelector('.more.content');
+if (!more || more.offsetParent === null) return null;
+const shown = document.querySelectorAll('{MENU_DIVS_CSS}').length;
+more.click();
+return shown;
+'''
 
-    # Iterate through the child div elements and extract information
-    for div in restaurant_divs:
-        if 'menu item category' in div.get_attribute('class'):
-            result_list.append(div.text)
-    # Check if result_list is empty and exit with an error message if true
-    if not result_list:
-        print(f"Error: No restaurants found, check input; perhaps the location ({url.split('/')[-1]}) you've provided is incorrect?\nExpected format is <address>-<city>")
-        sys.exit(1) 
-    driver.quit()
+MENU_COUNT_JS = f"return document.querySelectorAll('{MENU_DIVS_CSS}').length;"
 
-    return result_list
+# Times to click 'See more' for restaurants beyond the first page
+MORE_PAGES = 2
+
+# Seconds to wait for the restaurants of a 'See more' click; none by then means there are no more.
+# Kept well under the fetch timeout, so a click that adds nothing doesn't cost the page.
+MORE_WAIT = 3
+
+
+def _load_more(driver, pages = MORE_PAGES, wait_for = MORE_WAIT):
+    from selenium.common.exceptions import TimeoutException
+    from selenium.webdriver.support.ui import WebDriverWait
+
+    wait = WebDriverWait(driver, wait_for, poll_frequency = 0.1)
+    for _ in range(pages):
+        shown = driver.execute_script(CLICK_MORE_JS)
+        if shown is None:
+            break
+        try:
+            wait.until(lambda driver: driver.execute_script(MENU_COUNT_JS) > shown)
+        except TimeoutException:
+            break
+
+
+def _scrape_menu_records(driver, url, timeout = None, accept_cookies = True):
+    from selenium.webdriver.common.keys import Keys
+    from selenium.webdriver.common.action_chains import ActionChains
+
+    if timeout is not None:
+        driver.set_page_load_timeout(timeout)
+    with span('page_load'):
+        driver.get(url)
+
+    # The banner only shows until the browser has accepted cookies once
+    if accept_cookies:
+        with span('cookie_banner'):
+            # number of times to press TAB. This is used to navigate through cookies on the site
+            N = 3  
+
+            actions = ActionChains(driver) 
+            for _ in range(N):
+                actions = actions.send_keys(Keys.TAB)
+
+            # Accept cookies
+            actions = actions.send_keys(Keys.ENTER)
+            actions.perform()
+
+    # Get more restaurants by clicking 'See More', waiting for each batch to render
+    with span('load_more'):
+        _load_more(driver)
+
+    # One round trip for every restaurant on the page instead of two per div
+    with span('extract'):
+        extracted = driver.execute_script(MENU_RECORDS_JS)
+    count('elements_scanned', extracted['scanned'])
+
+    return extracted['records']
 
 # Define a function to convert distances to meters
 def convert_to_meters(distance_str):
@@ -62,17 +366,96 @@ def clean_menu_list(result_list):
     '''
     Exclude student restaurants and drop ratings. Clean distances into meters in numeric form
     '''
+    records = (menu_record(setti) for setti in result_list)
+    return clean_menu_records([record for record in records if record is not None])
+
+
+def clean_menu_records(records):
+    '''
+    Exclude student restaurants and turn the records of fetch_menu_records into the cleaned
+    restaurants, [name, opening hours, *menu, distance in meters] each.
+    '''
     restaurants = []
-    for setti in result_list:
-        setti = setti.split('\n')
+    for record in records:
+        name = record['name'].lower()
         # Exclude student restaurants
-        if 'unica' not in setti[0].lower() and 'kårkafé' not in setti[0].lower():
-            restaurants.append(setti)
-    restaurants = [[item for item in sublist if not (any(char.isdigit() for char in item) and '/' in item)] for sublist in restaurants]
-    restaurants = [[*sublist[:-1], convert_to_meters(sublist[-1])] for sublist in restaurants]
+        if 'unica' not in name and 'kårkafé' not in name:
+            restaurants.append([record['name'], record['hours'], *record['menu'], convert_to_meters(record['distance'])])
+    count('restaurants_scraped', len(records))
+    count('restaurants_kept', len(restaurants))
     return restaurants
 
+
+class Restaurants:
+    '''
+    Cleaned restaurants as columns sorted by distance, closest first, so cutting at a distance
+    is a bisect and the k closest a slice. to_frame() gives the DataFrame of create_df.
+    Indexing with a number gives the cleaned restaurant, [name, opening hours, *menu, distance].
+    '''
+    __slots__ = ('names', 'hours', 'menus', 'distances')
+
+    def __init__(self, names = (), hours = (), menus = (), distances = ()):
+        self.names = list(names)
+        self.hours = list(hours)
+        self.menus = list(menus)
+        self.distances = array('q', distances)
+
+    @classmethod
+    def from_cleaned(cls, restaurants):
+        '''
+        Build from the cleaned restaurants of clean_menu_list, in one pass after sorting by distance.
+        '''
+        self = cls()
+        for setti in sorted(restaurants, key = lambda setti: setti[-1]):
+            self.names.append(setti[0])
+            self.hours.append(setti[1])
+            self.menus.append(tuple(setti[2:-1]))
+            self.distances.append(setti[-1])
+        return self
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return Restaurants(self.names[index], self.hours[index], self.menus[index], self.distances[index])
+        return [self.names[index], self.hours[index], *self.menus[index], self.distances[index]]
+
+    def within(self, max_distance):
+        '''The restaurants at most max_distance meters away.'''
+        return self[:bisect_right(self.distances, max_distance)]
+
+    def nearest(self, k):
+        '''The k closest restaurants.'''
+        return self[:k]
+
+    def to_list(self):
+        '''The cleaned restaurants, closest first.'''
+        return [self[i] for i in range(len(self))]
+
+    def to_frame(self):
+        with span('create_df'):
+            import pandas as pd
+
+            return pd.DataFrame({
+                'Ravintola': self.names,
+                'Etäisyys': self.distances.tolist(),
+                'Aukiolo': self.hours,
+                'Menu': [list(menu) for menu in self.menus],
+            })
+
+
 def create_df(result_list):
+    '''
+    DataFrame of the cleaned restaurants of clean_menu_list, in their original order
+    '''
+    with span('create_df'):
+        return _create_df(result_list)
+
+
+def _create_df(result_list):
+    import pandas as pd
+
     restaurants = list()
     distances = list()
     open_hours = list()
@@ -84,14 +467,12 @@ def create_df(result_list):
         open_hours.append(setti[1])
         menu.append(setti[2:-1])
 
-        ravintelit = pd.DataFrame({
+    return pd.DataFrame({
         'Ravintola': restaurants,
         'Etäisyys': distances,
         'Aukiolo': open_hours,
         'Menu': menu
-        })
-    
-    return ravintelit
+    })
 
 
 def restaurant_for_the_day(df):
@@ -101,4 +482,14 @@ def restaurant_for_the_day(df):
     return df.sample(1)
 
 
+def restaurant_for_the_day_lean(restaurants, weights = None):
+    '''
+    Return one random restaurant from Restaurants, or the cleaned restaurants of clean_menu_list,
+    weighted by <weights> if given (see history.pick_weights)
+    '''
+    if weights is None:
+        return random.choice(restaurants)
+    return restaurants[random.choices(range(len(restaurants)), weights = weights)[0]]
+
+
 #print(clean_menu_list(get_menu_list(URL)))
\ No newline at end of file
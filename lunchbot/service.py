@@ -0,0 +1,331 @@
+'''
+Keeps the restaurants and forecasts of the configured offices in memory, refreshes them on a
+schedule and answers over a local HTTP endpoint:
+
+    GET  /lunch?location=<address-city>[&max_distance=500&time_of_day=11&ignore_rain=0]
+    GET  /status
+    POST /refresh[?location=<address-city>]
+'''
+
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from .lounasbotti import (FETCH_TIMEOUT, fetch_restaurants, fetch_weather_index, pick_weights, record_pick,
+                          select_restaurants, summarize_weather)
+from .restaurant_scraper import BACKENDS, DriverPool, location_url, restaurant_for_the_day_lean
+from . import cache, history
+import click
+import datetime
+import json
+import threading
+
+
+def next_daily_run(at, now = None):
+    '''
+    Next datetime at the (hour, minute) <at>, today if it's still ahead and tomorrow otherwise.
+    '''
+    now = now or datetime.datetime.now()
+    run = now.replace(hour = at[0], minute = at[1], second = 0, microsecond = 0)
+    return run if run > now else run + datetime.timedelta(days = 1)
+
+
+class LunchService:
+    '''
+    In-memory restaurants per location and weather indexes per city.
+
+    Refreshes swap complete snapshots in under a lock, so concurrent requests always see
+    either the old or the new data. A failed refresh keeps serving the previous snapshot
+    and reports the error in status().
+    '''
+
+    def __init__(self, locations, prefetch_at = (10, 30), weather_interval = 60, workers = 4,
+                 timeout = FETCH_TIMEOUT, backend = 'auto', use_cache = True, use_history = True):
+        self.locations = list(locations)
+        self.cities = {location: location.split('-')[1] for location in self.locations}
+        self.prefetch_at = prefetch_at
+        self.weather_interval = datetime.timedelta(minutes = weather_interval)
+        self.timeout = timeout
+        self.backend = backend
+        self.use_cache = use_cache
+        self.use_history = use_history
+
+        self._lock = threading.Lock()
+        self._menus = {location: self._empty_snapshot() for location in self.locations}
+        self._weather = {city: self._empty_snapshot() for city in self.cities.values()}
+        self._next_menus = None
+        self._next_weather = None
+        self._pick_lock = threading.Lock()
+        self._picks = {}    # (location, max_distance, time_of_day, ignore_rain) -> (day, name picked)
+
+        self._executor = ThreadPoolExecutor(max_workers = workers)
+        self._driver_pool = DriverPool(size = workers)
+        self._stop = threading.Event()
+        self._scheduler = threading.Thread(target = self._run_schedule, name = 'lunchbot-scheduler', daemon = True)
+
+    @staticmethod
+    def _empty_snapshot():
+        return {'value': None, 'fetched_at': None, 'error': None, 'refreshing': False}
+
+    def _refresh(self, snapshots, key, fetch, fetched_at):
+        # fetched_at() is called once the fetch is done, see _fetched_at
+        with self._lock:
+            if snapshots[key]['refreshing']:
+                return
+            snapshots[key] = {**snapshots[key], 'refreshing': True}
+        try:
+            value = fetch()
+        except Exception as error:
+            with self._lock:
+                snapshots[key] = {**snapshots[key], 'error': str(error), 'refreshing': False}
+            return
+        with self._lock:
+            snapshots[key] = {'value': value, 'fetched_at': fetched_at(), 'error': None, 'refreshing': False}
+
+    def _fetched_at(self, kind, key):
+        # Data read from the on-disk cache is as old as its entry, and a fetch has just rewritten it
+        written = cache.written_at(kind, key) if self.use_cache else None
+        return written or datetime.datetime.now()
+
+    def refresh_menus(self, location, from_cache = False):
+        '''
+        Fetch the restaurants of <location> again. from_cache allows reading them from the on-disk cache.
+        '''
+        url = location_url(location)
+        self._refresh(self._menus, location,
+                      lambda: fetch_restaurants(url, self.timeout, self.backend, self.use_cache, not from_cache,
+                                                self._driver_pool, self.use_history)[0],
+                      lambda: self._fetched_at('menus', cache.menu_key(location)))
+
+    def refresh_weather(self, city, from_cache = False):
+        '''
+        Fetch the forecast of <city> again. from_cache allows reading it from the on-disk cache.
+        '''
+        self._refresh(self._weather, city,
+                      lambda: fetch_weather_index(city, self.timeout, self.use_cache, not from_cache),
+                      lambda: self._fetched_at('weather', cache.weather_key(city)))
+
+    def refresh(self, locations = None, from_cache = False):
+        '''
+        Refresh <locations> (default: all) in the background, each of their cities' weather included.
+        from_cache allows answering from the on-disk cache instead of fetching again.
+        '''
+        locations = self.locations if locations is None else locations
+        for location in locations:
+            self._executor.submit(self.refresh_menus, location, from_cache)
+        for city in dict.fromkeys(self.cities[location] for location in locations):
+            self._executor.submit(self.refresh_weather, city, from_cache)
+
+    def _run_schedule(self):
+        while not self._stop.is_set():
+            now = datetime.datetime.now()
+            if now >= self._next_menus:
+                self.refresh()
+                self._next_menus = next_daily_run(self.prefetch_at, now)
+                self._next_weather = now + self.weather_interval
+            elif now >= self._next_weather:
+                for city in dict.fromkeys(self.cities.values()):
+                    self._executor.submit(self.refresh_weather, city)
+                self._next_weather = now + self.weather_interval
+            wait = min(self._next_menus, self._next_weather) - datetime.datetime.now()
+            self._stop.wait(max(wait.total_seconds(), 0))
+
+    def start(self):
+        '''Fetch everything once, from the on-disk cache where it's fresh enough, and start the schedule.'''
+        now = datetime.datetime.now()
+        self.refresh(from_cache = True)
+        self._next_menus = next_daily_run(self.prefetch_at, now)
+        self._next_weather = now + self.weather_interval
+        self._scheduler.start()
+
+    def close(self):
+        self._stop.set()
+        self._executor.shutdown(wait = True, cancel_futures = True)
+        self._driver_pool.close()
+
+    def lunch(self, location, max_distance = 500, time_of_day = 11, ignore_rain = False):
+        '''
+        The restaurant of the day for <location>, from memory. It is picked once a day for each set
+        of arguments and served again for the rest of the day, unless the weather has since cut it
+        out of the selection. With use_history the first pick of the day at <location> is logged, see
+        history.record_pick, and picked again by the other arguments where it's in their selection.
+        Raises KeyError for a location that isn't configured and LookupError before the first fetch.
+        '''
+        with self._lock:
+            menus = self._menus[location]
+            weather = self._weather[self.cities[location]]
+        if menus['value'] is None:
+            raise LookupError(f'Restaurants of {location} not fetched yet: {menus["error"] or "refreshing"}')
+
+        summary = None
+        if weather['value'] is not None:
+            try:
+                summary = summarize_weather(weather['value'], time_of_day)
+            except KeyError:
+                pass  # time_of_day outside the forecast window
+
+        restaurants = select_restaurants(menus['value'], summary, max_distance, ignore_rain)
+        answer = {
+            'location': location,
+            'restaurant': None,
+            'weather': None,
+            'status': {
+                'menus': self._snapshot_status(menus, datetime.timedelta(days = 1)),
+                'weather': self._snapshot_status(weather, datetime.timedelta(seconds = cache.WEATHER_TTL)),
+            },
+        }
+        if len(restaurants):
+            restaurant = self._pick(location, restaurants, (location, max_distance, time_of_day, ignore_rain))
+            answer['restaurant'] = {
+                'name': restaurant[0],
+                'distance': restaurant[-1],
+                'open': restaurant[1],
+                'menu': restaurant[2:-1],
+            }
+        if summary is not None:
+            answer['weather'] = {key: value if isinstance(value, bool) else float(value)
+                                 for key, value in summary.items()}
+        return answer
+
+    def _pick(self, location, restaurants, key):
+        today = datetime.date.today()
+        with self._pick_lock:
+            day, name = self._picks.get(key, (None, None))
+            if day != today or name not in restaurants.names:
+                # The pick logged today, before a restart or by lounasbotti, is the one to serve
+                logged = [name for _, name in history.picks(location, 1, today)] if self.use_history else []
+                name = next((name for name in logged if name in restaurants.names), None)
+                if name is None:
+                    weights = pick_weights(location, restaurants) if self.use_history else None
+                    name = restaurant_for_the_day_lean(restaurants, weights)[0]
+                    if self.use_history and not logged:
+                        record_pick(location, name)
+                self._picks[key] = (today, name)
+        return restaurants[restaurants.names.index(name)]
+
+    @staticmethod
+    def _snapshot_status(snapshot, max_age):
+        fetched_at = snapshot['fetched_at']
+        age = (datetime.datetime.now() - fetched_at).total_seconds() if fetched_at else None
+        return {
+            'fetched_at': fetched_at.isoformat(timespec = 'seconds') if fetched_at else None,
+            'age_seconds': age,
+            'stale': fetched_at is None or age > max_age.total_seconds()
+                     or fetched_at.date() != datetime.date.today(),
+            'refreshing': snapshot['refreshing'],
+            'error': snapshot['error'],
+        }
+
+    def status(self):
+        with self._lock:
+            menus = dict(self._menus)
+            weather = dict(self._weather)
+        return {
+            'menus': {location: self._snapshot_status(snapshot, datetime.timedelta(days = 1))
+                      for location, snapshot in menus.items()},
+            'weather': {city: self._snapshot_status(snapshot, datetime.timedelta(seconds = cache.WEATHER_TTL))
+                        for city, snapshot in weather.items()},
+            'next_prefetch': self._next_menus.isoformat(timespec = 'seconds') if self._next_menus else None,
+            'next_weather_refresh': self._next_weather.isoformat(timespec = 'seconds') if self._next_weather else None,
+        }
+
+
+class LunchRequestHandler(BaseHTTPRequestHandler):
+
+    def _reply(self, status, body):
+        data = json.dumps(body, ensure_ascii = False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        service = self.server.service
+        url = urlparse(self.path)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+
+        if url.path == '/status':
+            return self._reply(200, service.status())
+        if url.path != '/lunch':
+            return self._reply(404, {'error': f'unknown path {url.path}'})
+
+        location = query.get('location', service.locations[0])
+        try:
+            answer = service.lunch(
+                location,
+                max_distance = int(query.get('max_distance', 500)),
+                time_of_day = int(query.get('time_of_day', 11)),
+                ignore_rain = query.get('ignore_rain', '0').lower() in ('1', 'true', 'yes'),
+            )
+        except ValueError as error:
+            return self._reply(400, {'error': str(error)})
+        except KeyError:
+            return self._reply(404, {'error': f'location {location} is not configured'})
+        except LookupError as error:
+            return self._reply(503, {'error': str(error)})
+        self._reply(200, answer)
+
+    def do_POST(self):
+        service = self.server.service
+        url = urlparse(self.path)
+        if url.path != '/refresh':
+            return self._reply(404, {'error': f'unknown path {url.path}'})
+        locations = parse_qs(url.query).get('location')
+        unknown = [location for location in locations or [] if location not in service.cities]
+        if unknown:
+            return self._reply(404, {'error': f'locations {", ".join(unknown)} are not configured'})
+        service.refresh(locations)
+        self._reply(202, {'refreshing': locations or service.locations})
+
+
+def parse_clock(ctx, param, value):
+    try:
+        hour, minute = (int(part) for part in value.split(':'))
+        datetime.time(hour, minute)
+    except ValueError:
+        raise click.BadParameter(f'{value}, expected HH:MM')
+    return hour, minute
+
+
+@click.command()
+@click.option('--location', 'locations', type=str, multiple=True, default=['vallihaudankatu-turku'],
+              help='Location to keep ready, can be given several times (default: vallihaudankatu-turku)')
+@click.option('--host', type=str, default='127.0.0.1', help='Address to listen on (default: 127.0.0.1)')
+@click.option('--port', type=int, default=8080, help='Port to listen on (default: 8080)')
+@click.option('--prefetch_at', type=str, default='10:30', callback=parse_clock,
+              help='Time of day to fetch the day\'s menus, HH:MM (default: 10:30)')
+@click.option('--weather_interval', type=int, default=60,
+              help='Minutes between forecast refreshes (default: 60)')
+@click.option('--workers', type=int, default=4,
+              help='Locations refreshed at the same time, also the number of browsers started at most (default: 4)')
+@click.option('--backend', type=click.Choice(['auto', *BACKENDS]), default='auto',
+              help='Scraping backend, auto falls back to selenium if plain HTTP finds nothing (default: auto)')
+@click.option('--timeout', type=float, default=FETCH_TIMEOUT,
+              help=f'Seconds to wait for each fetch before giving up (default: {FETCH_TIMEOUT})')
+@click.option('--cache/--no-cache', 'use_cache', default=True,
+              help='Share the on-disk cache with lunchbot runs (default: True)')
+@click.option('--history/--no-history', 'use_history', default=True,
+              help='Archive the menus of the day and make recently picked restaurants less likely (default: True)')
+def main(locations, host, port, prefetch_at, weather_interval, workers, backend, timeout, use_cache, use_history):
+    for location in locations:
+        if '-' not in location:
+            raise click.BadParameter(f'{location}, expected format is <address>-<city>', param_hint='--location')
+
+    service = LunchService(locations, prefetch_at = prefetch_at, weather_interval = weather_interval,
+                           workers = workers, timeout = timeout, backend = backend, use_cache = use_cache,
+                           use_history = use_history)
+    server = ThreadingHTTPServer((host, port), LunchRequestHandler)
+    server.service = service
+
+    service.start()
+    print(f'Serving lunch on http://{host}:{server.server_port}/lunch')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,26 @@
+'''
+The pooled requests session every lunchbot query goes over, so repeated queries to lounaat.info
+and FMI reuse their TCP/TLS connections. Modules that need their own headers pass them per request.
+'''
+
+from __future__ import annotations
+
+import threading
+from typing import TYPE_CHECKING
+
+# requests is imported on first use, so the CLI starts without it
+if TYPE_CHECKING:
+    import requests as rq
+
+_session = None
+_lock = threading.Lock()
+
+
+def get_session() -> rq.Session:
+    '''The session, created on first use. Safe to share between threads.'''
+    global _session
+    with _lock:
+        if _session is None:
+            import requests as rq
+            _session = rq.Session()
+    return _session
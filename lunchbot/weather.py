@@ -3,157 +3,375 @@ Module to fetch weather forecast for the day.
 API used https://www.ilmatieteenlaitos.fi/avoin-data
 '''
 
+from __future__ import annotations
+
 import datetime
-import requests as rq
-import pandas as pd
+import io
+import math
+import threading
+import time
 import xml.etree.ElementTree as ET
+from typing import IO, TYPE_CHECKING
+from .profiling import count, span
+from .session import get_session
+
+# pandas, numpy and requests are imported where they're used, so the CLI starts without them
+if TYPE_CHECKING:
+    import pandas as pd
+
+# FMI open data WFS endpoint
+FMI_URL = 'http://opendata.fmi.fi/wfs'
+
+# Parameters lunchbot reads from the forecast, the only ones requested
+WEATHER_PARAMETERS = ['Temperature', 'WindSpeedMS', 'PrecipitationAmount', 'Precipitation1h', 'TotalCloudCover']
 
+# Seconds a forecast hour held in memory is reused, see ForecastStore
+FORECAST_MAX_AGE = 60 * 60
 
-def create_url(city: str, n_hours: int = 12) -> str:
+def create_url(city: str, n_hours: int = 12, start: datetime.datetime | None = None,
+               end: datetime.datetime | None = None) -> str:
     """
     Generates the API URL for fetching weather data for the specified city and duration.
+    Only WEATHER_PARAMETERS are requested, one value per hour.
     
     Parameters:
     - city (str): Target city for the weather data.
     - n_hours (int): Forecast duration in hours (max 12).
+    - start, end (datetime, optional): Forecast window in UTC, see forecast_window. Defaults to
+      08:00 to current time + n_hours.
     
     Returns:
     - str: Formatted API URL.
     """
-    n_hours = min(n_hours, 12)
-    current_time = datetime.datetime.now()
-    end_time = current_time + datetime.timedelta(hours = n_hours)
+    if start is None or end is None:
+        n_hours = min(n_hours, 12)
+        current_time = datetime.datetime.now()
+        start = current_time.replace(hour = 8, minute = 0, second = 0, microsecond = 0)
+        end = current_time + datetime.timedelta(hours = n_hours)
     
     return (
-        f"http://opendata.fmi.fi/wfs?service=WFS&version=2.0.0&request=getFeature&"
+        f"{FMI_URL}?service=WFS&version=2.0.0&request=getFeature&"
         f"storedquery_id=ecmwf::forecast::surface::point::simple&place={city.lower()}&"
-        f"starttime={current_time.strftime('%Y-%m-%dT08:00:00Z')}&"
-        f"endtime={end_time.strftime('%Y-%m-%dT%H:%M:%SZ')}&"
+        f"parameters={','.join(WEATHER_PARAMETERS)}&timestep=60&"
+        f"starttime={start.strftime('%Y-%m-%dT%H:%M:%SZ')}&"
+        f"endtime={end.strftime('%Y-%m-%dT%H:%M:%SZ')}&"
     )
 
 
-def get_weather_xml(url: str) -> str:
-    """Fetches XML data from the weather API URL."""
-    response = rq.get(url)
+def forecast_window(first_hour: int = 8, last_hour: int | None = None,
+                    day: datetime.date | None = None) -> tuple[datetime.datetime, datetime.datetime]:
+    """
+    Start and end of the forecast window from first_hour to last_hour of <day>, both included.
+    Hours are UTC, like the hours of the weather index; day defaults to today in UTC and
+    last_hour to 12 hours from now, as in the default window of create_url.
+    """
+    now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo = None, minute = 0, second = 0, microsecond = 0)
+    midnight = datetime.datetime.combine(day or now.date(), datetime.time())
+    if last_hour is None:
+        return midnight + datetime.timedelta(hours = first_hour), now + datetime.timedelta(hours = 12)
+    return midnight + datetime.timedelta(hours = first_hour), midnight + datetime.timedelta(hours = last_hour)
+
+
+def get_weather_xml(url: str, timeout: float | None = None) -> str:
+    """Fetches XML data from the weather API URL, giving up after timeout seconds."""
+    response = get_session().get(url, timeout = timeout)
     response.raise_for_status()
     return response.text
 
 
-def parse_weather_xml(xml_data: str) -> pd.DataFrame:
+# Qualified tag names of the FMI simple feature format, as ElementTree reports them
+BSWFS = '{http://xml.fmi.fi/schema/wfs/2.0}'
+GML = '{http://www.opengis.net/gml/3.2}'
+WFS = '{http://www.opengis.net/wfs/2.0}'
+
+# Column each field of a BsWfsElement is collected into
+FIELDS = {
+    f'{GML}pos': 'Location',
+    f'{BSWFS}Time': 'Time',
+    f'{BSWFS}ParameterName': 'ParameterName',
+    f'{BSWFS}ParameterValue': 'ParameterValue',
+}
+
+
+def _iter_weather_elements(xml_data: str | bytes | IO[bytes]):
+    # Streams the document with iterparse, yielding the fields of each BsWfsElement as strings
+    # and dropping elements once read, so a response can be parsed straight from the socket.
+    if isinstance(xml_data, str):
+        xml_data = xml_data.encode('utf-8')
+    if isinstance(xml_data, bytes):
+        xml_data = io.BytesIO(xml_data)
+
+    record = {}
+    root = None
+
+    for event, element in ET.iterparse(xml_data, events = ('start', 'end')):
+        if root is None:
+            root = element
+        if event == 'start':
+            continue
+        column = FIELDS.get(element.tag)
+        if column is not None:
+            record[column] = element.text
+        elif element.tag == f'{BSWFS}BsWfsElement':
+            # Skip entries with missing data
+            if len(record) == len(FIELDS) and None not in record.values():
+                yield record
+            record = {}
+        elif element.tag == f'{WFS}member':
+            root.clear()
+
+
+def parse_weather_xml(xml_data: str | bytes | IO[bytes]) -> pd.DataFrame:
     """
     Parses XML data to create a DataFrame with location, time, parameter name, and values.
+
+    The document is streamed and values are collected into columns, the frame is built once at the end.
     
     Parameters:
-    - xml_data (str): XML formatted weather data from the API.
+    - xml_data (str | bytes | file-like): XML formatted weather data from the API.
     
     Returns:
     - pd.DataFrame: DataFrame containing parsed weather data.
     """
-    root = ET.fromstring(xml_data)
-    records = []
+    columns = {column: [] for column in FIELDS.values()}
+    for record in _iter_weather_elements(xml_data):
+        for column, value in record.items():
+            columns[column].append(value)
+    return _weather_frame(columns, time_format = '%Y-%m-%dT%H:%M:%SZ')
 
-    for element in root.findall('.//BsWfs:BsWfsElement', namespaces={'BsWfs': 'http://xml.fmi.fi/schema/wfs/2.0'}):
-        try:
-            records.append({
-                'Location': element.find('.//gml:pos', namespaces={'gml': 'http://www.opengis.net/gml/3.2'}).text,
-                'Time': element.find('.//BsWfs:Time', namespaces={'BsWfs': 'http://xml.fmi.fi/schema/wfs/2.0'}).text,
-                'ParameterName': element.find('.//BsWfs:ParameterName', namespaces={'BsWfs': 'http://xml.fmi.fi/schema/wfs/2.0'}).text,
-                'ParameterValue': float(element.find('.//BsWfs:ParameterValue', namespaces={'BsWfs': 'http://xml.fmi.fi/schema/wfs/2.0'}).text)
-            })
-        except AttributeError:
-            pass  # Skip entries with missing data
 
-    df = pd.DataFrame(records)
-    df['Time'] = pd.to_datetime(df['Time'])
-    return df
+def _weather_frame(columns: dict[str, list], time_format: str) -> pd.DataFrame:
+    # Typed columns: categorical location and parameter, UTC times and float64 values
+    import numpy as np
+    import pandas as pd
 
+    return pd.DataFrame({
+        'Location': pd.Categorical(columns['Location']),
+        'Time': pd.to_datetime(columns['Time'], format = time_format, utc = True),
+        'ParameterName': pd.Categorical(columns['ParameterName']),
+        'ParameterValue': np.array(columns['ParameterValue'], dtype = np.float64),
+    })
 
 
 def get_weather(df: pd.DataFrame) -> pd.DataFrame:
     """Filters DataFrame for relevant weather parameters."""
-    return df[df['ParameterName'].isin(['Temperature', 'WindSpeedMS', 'PrecipitationAmount', 'Precipitation1h', 'TotalCloudCover'])]
+    return df[df['ParameterName'].isin(WEATHER_PARAMETERS)]
+
+
+def index_weather(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Pivots the parsed forecast into one row per hour of day and one column per parameter.
+
+    When the window covers the same hour twice, the latest forecast for it is kept.
+    Lookups by hour (.loc[hour]) and by parameter (row[name]) are then O(1).
+
+    Parameters:
+    - df (pd.DataFrame): Parsed weather data, see parse_weather_xml and weather_from_records.
+
+    Returns:
+    - pd.DataFrame: Weather index with the hour of day as index and WEATHER_PARAMETERS as columns.
+    """
+    wide = (df.drop_duplicates(['Time', 'ParameterName'], keep = 'last')
+              .pivot(index = 'Time', columns = 'ParameterName', values = 'ParameterValue')
+              .sort_index())
+    wide = wide[~wide.index.hour.duplicated(keep = 'last')]
+    wide.index = wide.index.hour.rename('Hour')
+    wide.columns = wide.columns.astype(str)
+    return wide.reindex(columns = WEATHER_PARAMETERS)
+
+
+def _terrace_conditions(weather, min_temp):
+    # Works on a single hour (Series) and on the whole index (DataFrame) alike
+    import pandas as pd
 
+    return ((weather['Temperature'] >= min_temp)
+            & pd.isna(weather['WindSpeedMS'])
+            & (weather['Precipitation1h'] == 0.0)
+            & pd.isna(weather['TotalCloudCover']))
 
 
-def terrace_weather(df: pd.DataFrame, min_temp: int = 15) -> bool:
+def terrace_weather_by_hour(weather_index: pd.DataFrame, min_temp: int = 15) -> pd.Series:
+    """
+    Terrace weather verdict for every hour of the weather index at once, see terrace_weather.
+    """
+    return _terrace_conditions(weather_index, min_temp)
+
+
+def terrace_weather(df: pd.Series, min_temp: int = 15) -> bool:
     """
     Checks if conditions are favorable for outdoor seating ('terassikeli').
 
     Parameters:
-    - df (pd.DataFrame): Filtered DataFrame with latest weather data.
+    - df (pd.Series): Weather of one hour, see get_weather_by_hour.
     - min_temp (int): Minimum temperature for favorable conditions.
     
     Returns:
     - bool: True if conditions are favorable, False otherwise.
     """
-    latest_data = df.loc[df.groupby('ParameterName')['Time'].idxmax()]
-    conditions = {
-        'Temperature': latest_data[latest_data['ParameterName'] == 'Temperature']['ParameterValue'].iloc[0] >= min_temp,
-        'WindSpeedMS': latest_data[latest_data['ParameterName'] == 'WindSpeedMS']['ParameterValue'].isna(),
-        'Precipitation1h': latest_data[latest_data['ParameterName'] == 'Precipitation1h']['ParameterValue'].iloc[0] == 0.0,
-        'TotalCloudCover': latest_data[latest_data['ParameterName'] == 'TotalCloudCover']['ParameterValue'].isna()
-    }
-    return all(conditions.values())
+    return bool(_terrace_conditions(df, min_temp))
 
-def get_weather_by_hour(df: pd.DataFrame, time_of_day: int) -> pd.DataFrame:
+def get_weather_by_hour(weather_index: pd.DataFrame, time_of_day: int) -> pd.Series:
     '''
-    Function to get the current weather based on the specified time of day (hour).
+    Function to get the weather of the specified time of day (hour) from the weather index.
+    '''
+    return weather_index.loc[time_of_day]
+
+
+def get_weather_records(n_hours: int, city: str, timeout: float | None = None, start: datetime.datetime | None = None,
+                        end: datetime.datetime | None = None) -> list[dict]:
+    '''
+    Fetch the forecast for <city> for the next n_hours (8AM to current_time + n_hours), or from start
+    to end if given, as records {'Location', 'Time', 'ParameterName', 'ParameterValue'} of the relevant
+    weather parameters. See weather_from_records for the DataFrame.
+    '''
+    url = create_url(n_hours = n_hours, city = city, start = start, end = end)
+    with span('request'):
+        response = get_session().get(url, timeout = timeout, stream = True)
+    with response:
+        response.raise_for_status()
+        response.raw.decode_content = True
+        # Download and parse overlap, the body is parsed as it streams in
+        with span('download_and_parse'):
+            records = [{**record, 'ParameterValue': float(record['ParameterValue'])}
+                       for record in _iter_weather_elements(response.raw)
+                       if record['ParameterName'] in WEATHER_PARAMETERS]
+        count('weather_bytes', response.raw.tell())
+    return records
+
+
+class ForecastStore:
+    '''
+    Forecast records per city and hour, held in memory so overlapping windows are downloaded once.
+
+    records() serves the hours of a window it already holds and fetches only the span of the
+    missing ones, one query per city over the pooled session. Hours older than max_age seconds
+    count as missing. Safe to share between threads; a city is only fetched by one at a time.
     '''
-    # Filter the DataFrame based on the specified time of day (hour)
-    df = df[df['Time'].dt.hour == time_of_day]
 
-    # Group by 'ParameterName' and find the row with the latest timestamp in each group
-    latest_timestamp_df = df.loc[df.groupby('ParameterName')['Time'].idxmax()]
+    def __init__(self, max_age: float = FORECAST_MAX_AGE):
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._city_locks = {}
+        self._hours = {}    # (city, 'YYYY-MM-DDTHH') -> (fetched at, records of that hour)
 
-    # Filter the DataFrame based on the conditions to get the current weather
-    latest_timestamp_df = latest_timestamp_df[latest_timestamp_df['ParameterName'].isin(['Temperature', 'WindSpeedMS', 'PrecipitationAmount', 'Precipitation1h', 'TotalCloudCover'])]
+    def records(self, city: str, start: datetime.datetime, end: datetime.datetime, timeout: float | None = None,
+                refresh: bool = False) -> list[dict]:
+        '''
+        Records of every hour of <city> from start to end (UTC, both included), see get_weather_records.
+        refresh fetches the whole window again.
+        '''
+        city = city.lower()
+        hours = [(start + datetime.timedelta(hours = i)).strftime('%Y-%m-%dT%H')
+                 for i in range(int((end - start).total_seconds() // 3600) + 1)]
+        with self._lock:
+            city_lock = self._city_locks.setdefault(city, threading.Lock())
 
-    return latest_timestamp_df
+        with city_lock:
+            now = time.monotonic()
+            # The window is served from the entries read here, as another city's fetch may purge them meanwhile
+            with self._lock:
+                held = {hour: self._hours.get((city, hour)) for hour in hours}
+            missing = [hour for hour, entry in held.items()
+                       if refresh or entry is None or now - entry[0] > self.max_age]
+            count('weather_hours_reused', len(hours) - len(missing))
 
+            if missing:
+                first = datetime.datetime.strptime(missing[0], '%Y-%m-%dT%H')
+                last = datetime.datetime.strptime(missing[-1], '%Y-%m-%dT%H')
+                fetched = {hour: [] for hour in hours[hours.index(missing[0]):hours.index(missing[-1]) + 1]}
+                for record in get_weather_records(n_hours = 12, city = city, timeout = timeout, start = first,
+                                                  end = last):
+                    fetched.setdefault(record['Time'][:13], []).append(record)
+                with self._lock:
+                    # Drop what has gone stale meanwhile, so a long-running process doesn't grow without end
+                    for key in [key for key, (fetched_at, _) in self._hours.items() if now - fetched_at > self.max_age]:
+                        del self._hours[key]
+                    for hour, hour_records in fetched.items():
+                        self._hours[(city, hour)] = (now, hour_records)
+                held.update((hour, (now, fetched[hour])) for hour in fetched if hour in held)
 
-def get_weather_data(n_hours: int, city: str) -> pd.DataFrame:
+            return [record for hour in hours for record in held[hour][1]]
+
+    def clear(self):
+        with self._lock:
+            self._hours.clear()
+
+
+# Forecasts fetched by this process
+forecasts = ForecastStore()
+
+
+def index_weather_lean(records: list[dict]) -> dict[int, dict[str, float]]:
     '''
-    Fetch weather data for <city> for the next n_hours, starting from the current time.
-    Total amount of weather data fetched is from 8AM to current_time + n_hours
+    Pandas-free index_weather: {hour of day: {parameter: value}} from weather records.
+    When the records cover the same hour twice, the latest forecast for it is kept.
     '''
-    weather_xml = get_weather_xml(create_url(n_hours = n_hours, city = city))
-    weather_df = parse_weather_xml(weather_xml)
-    return get_weather(weather_df)
+    weather_index = {}
+    latest = {}
+    for record in records:
+        name = record['ParameterName']
+        if name not in WEATHER_PARAMETERS:
+            continue
+        # FMI times end in Z, which fromisoformat only reads from Python 3.11 on
+        time = datetime.datetime.fromisoformat(record['Time'].replace('Z', '+00:00'))
+        if latest.get((time.hour, name), time) > time:
+            continue
+        latest[(time.hour, name)] = time
+        hour = weather_index.setdefault(time.hour, dict.fromkeys(WEATHER_PARAMETERS, math.nan))
+        hour[name] = float(record['ParameterValue'])
+    return weather_index
+
+
+def terrace_weather_lean(weather: dict[str, float], min_temp: int = 15) -> bool:
+    '''
+    Pandas-free terrace_weather for the weather of one hour from index_weather_lean.
+    '''
+    return (weather['Temperature'] >= min_temp
+            and math.isnan(weather['WindSpeedMS'])
+            and weather['Precipitation1h'] == 0.0
+            and math.isnan(weather['TotalCloudCover']))
+
+def weather_from_records(records: list[dict]) -> pd.DataFrame:
+    '''
+    The DataFrame of parse_weather_xml from the records of get_weather_records, built column by column.
+    '''
+    columns = {column: [record[column] for record in records] for column in FIELDS.values()}
+    # Cache entries written before the records were kept as FMI sends them have +00:00 times
+    return _weather_frame(columns, time_format = 'ISO8601')
 
-def get_current_and_next_hour_data(weather_data: pd.DataFrame, hour: int) -> pd.DataFrame:
+def get_current_and_next_hour_data(weather_index: pd.DataFrame, hour: int) -> tuple[pd.Series, pd.Series]:
     '''
-    Filtering function to extract current and the following hours' weather data
+    Lookup function to extract current and the following hours' weather data
 
     Parameters:
-    weather_data (pd.DataFrame): DF containing weather data
+    weather_index (pd.DataFrame): Weather index, see index_weather
     hour (int): time of day as an integer.
 
     Returns:
     Weather data for the current and next hours.
     '''
-    current_hour_data = get_weather_by_hour(weather_data, hour)
-    next_hour_data = get_weather_by_hour(weather_data, hour + 1)
+    current_hour_data = get_weather_by_hour(weather_index, hour)
+    next_hour_data = get_weather_by_hour(weather_index, hour + 1)
     return current_hour_data, next_hour_data
 
-def get_parameter_value(data: pd.DataFrame, parameter_name: str) -> str | int:
+def get_parameter_value(data: pd.Series | dict, parameter_name: str) -> float:
     '''
-    Reads single weather value from df and returns it.
+    Reads single weather value from the weather of one hour and returns it.
 
     Parameters:
-    df (pd.DataFrame): DF containing weather data
-    parameter_name (str): Column which value to extract
+    data (pd.Series | dict): Weather of one hour, see get_weather_by_hour and index_weather_lean
+    parameter_name (str): Parameter which value to extract
 
     Returns:
     Value of parameter parameter_name.
 
     Used in main to determine weather conditions.
     '''
-    parameter_data = data[data['ParameterName'] == parameter_name]
-    return parameter_data['ParameterValue'].values[0]
+    return data[parameter_name]
 
 
 if __name__ == '__main__':
     # Fetch weather data for <location> for the next n hours
     weather_xml = get_weather_xml(create_url(n_hours = 3, city = 'HElsiNKi'))
     weather_df = parse_weather_xml(weather_xml)
-    print(get_weather(weather_df))
\ No newline at end of file
+    print(index_weather(get_weather(weather_df)))
\ No newline at end of file
@@ -6,11 +6,14 @@ with open('requirements.txt') as f:
 setup(
     name="lunchbot-cli",
     version="1.0",
-    packages=find_packages(),
+    packages=find_packages(exclude=['benchmarks', 'benchmarks.*']),
     install_requires=required_packages, 
     entry_points={
         'console_scripts': [
-            'lunchbot=lunchbot.lounasbotti:main', 
+            'lunchbot=lunchbot.lounasbotti:main',
+            'lunchbot-batch=lunchbot.batch:main',
+            'lunchbot-serve=lunchbot.service:main',
+            'lunchbot-history=lunchbot.history:main',
         ],
     },
     python_requires='>=3.6',  
@@ -0,0 +1,10 @@
+import pytest
+from lunchbot import cache, history
+
+
+@pytest.fixture(autouse = True)
+def data_dirs(tmp_path, monkeypatch):
+    '''Keep the cache and the history of every test in its own temporary directory.'''
+    monkeypatch.setattr(cache, 'CACHE_DIR', str(tmp_path / 'cache'))
+    monkeypatch.setattr(history, 'HISTORY_DIR', str(tmp_path / 'history'))
+    return tmp_path
@@ -0,0 +1,58 @@
+import os
+import time
+from lunchbot import cache
+
+
+def age(kind, key, seconds):
+    path = cache._entry_path(kind, key)
+    then = time.time() - seconds
+    os.utime(path, (then, then))
+
+
+def test_read_returns_what_was_written():
+    cache.write('menus', ('vallihaudankatu-turku', '2024-10-18'), [['Ravintola', '10-14', 'Keitto', 200]])
+    assert cache.read('menus', ('vallihaudankatu-turku', '2024-10-18'), cache.MENU_TTL) == \
+        [['Ravintola', '10-14', 'Keitto', 200]]
+
+
+def test_read_misses_missing_and_expired_entries():
+    assert cache.read('weather', ('turku', '2024-10-18T11'), cache.WEATHER_TTL) is None
+
+    cache.write('weather', ('turku', '2024-10-18T11'), [{'Temperature': 12.0}])
+    age('weather', ('turku', '2024-10-18T11'), cache.WEATHER_TTL + 1)
+    assert cache.read('weather', ('turku', '2024-10-18T11'), cache.WEATHER_TTL) is None
+    assert cache.read('weather', ('turku', '2024-10-18T11'), cache.WEATHER_TTL + 60) == [{'Temperature': 12.0}]
+
+
+def test_read_misses_unreadable_entries():
+    cache.write('menus', ('turku',), [])
+    with open(cache._entry_path('menus', ('turku',)), 'w') as f:
+        f.write('[["cut sh')
+    assert cache.read('menus', ('turku',), cache.MENU_TTL) is None
+
+
+def test_evict_removes_the_least_recently_written():
+    for day in range(5):
+        cache.write('menus', ('turku', day), day)
+        age('menus', ('turku', day), 100 - day)
+
+    cache.evict('menus', max_entries = 2)
+
+    assert sorted(os.listdir(os.path.join(cache.CACHE_DIR, 'menus'))) == ['turku__3.json', 'turku__4.json']
+
+
+def test_write_evicts_beyond_max_entries():
+    for day in range(4):
+        cache.write('menus', ('turku', day), day, max_entries = 3)
+        age('menus', ('turku', day), 100 - day)
+
+    cache.write('menus', ('turku', 4), 4, max_entries = 3)
+
+    assert cache.read('menus', ('turku', 0), cache.MENU_TTL) is None
+    assert cache.read('menus', ('turku', 1), cache.MENU_TTL) is None
+    assert [cache.read('menus', ('turku', day), 1000) for day in (2, 3, 4)] == [2, 3, 4]
+
+
+def test_weather_key_separates_forecast_windows():
+    assert cache.weather_key('turku', hours = (11, 12)) != cache.weather_key('turku')
+    assert cache.weather_key('turku', hours = (11, 12))[-1] == '11-12'
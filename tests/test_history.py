@@ -0,0 +1,75 @@
+import datetime
+import pytest
+from lunchbot import history
+
+TODAY = datetime.date(2024, 11, 2)
+
+
+def day(days_ago):
+    return TODAY - datetime.timedelta(days = days_ago)
+
+
+@pytest.fixture
+def archived():
+    '''Two weeks of turku, over a month boundary, and one day of helsinki.'''
+    for days_ago in range(14):
+        restaurants = [['Pinni', '10-14', 'Lohikeitto L, G', '11,50 €', 200],
+                       ['Kupla', '11-14', 'Kasvislasagne VE' if days_ago % 2 else 'Broileria, riisiä', 450]]
+        if days_ago == 10:
+            restaurants.append(['Ravintola 3', '10-13', 'Pizza', 900])
+        history.archive('vallihaudankatu-turku', restaurants, day(days_ago))
+    history.archive('kamppi-helsinki', [['Kupla', '10-14', 'Lohikeitto', 300]], day(0))
+
+
+def test_archive_keeps_the_first_archive_of_a_day(archived):
+    assert not history.archive('vallihaudankatu-turku', [['Muu', '10-14', 100]], day(0))
+    assert history.appearances('muu', today = TODAY) == []
+
+
+def test_appearances_of_a_name(archived):
+    assert history.appearances('ravintola 3', today = TODAY) == [
+        ('2024-10-23', 'vallihaudankatu-turku', 'Ravintola 3')]
+    assert history.appearances('Kupla', days = 2, today = TODAY) == [
+        ('2024-11-01', 'vallihaudankatu-turku', 'Kupla'),
+        ('2024-11-02', 'kamppi-helsinki', 'Kupla'),
+        ('2024-11-02', 'vallihaudankatu-turku', 'Kupla'),
+    ]
+
+
+def test_appearances_of_menu_words(archived):
+    found = history.appearances('kasvislasagne', days = 5, location = 'vallihaudankatu-turku', today = TODAY)
+    assert found == [('2024-10-30', 'vallihaudankatu-turku', 'Kupla'), ('2024-11-01', 'vallihaudankatu-turku', 'Kupla')]
+    # Every word has to match, and prices aren't searchable
+    assert history.appearances('lohikeitto pinni', days = 1, today = TODAY) == [
+        ('2024-11-02', 'vallihaudankatu-turku', 'Pinni')]
+    assert history.appearances('lohikeitto pizza', today = TODAY) == []
+    assert history.appearances('11', today = TODAY) == []
+
+
+def test_not_visited(archived):
+    history.record_pick('vallihaudankatu-turku', 'Pinni', day(1))
+    history.record_pick('vallihaudankatu-turku', 'Ravintola 3', day(10))
+
+    assert history.not_visited('vallihaudankatu-turku', days = 7, today = TODAY) == ['Kupla']
+    assert history.not_visited('vallihaudankatu-turku', days = 14, today = TODAY) == ['Kupla']
+    assert history.not_visited('vallihaudankatu-turku', days = 1, today = TODAY) == ['Kupla', 'Pinni']
+    assert history.not_visited('kamppi-helsinki', today = TODAY) == ['Kupla']
+
+
+def test_pick_weights():
+    history.record_pick('vallihaudankatu-turku', 'Pinni', day(0))
+    history.record_pick('vallihaudankatu-turku', 'Kupla', day(3))
+    history.record_pick('vallihaudankatu-turku', 'Kupla', day(1))
+    history.record_pick('vallihaudankatu-turku', 'Ravintola 3', day(20))
+    restaurants = [['Pinni', '10-14', 200], ['Kupla', '11-14', 450], ['Ravintola 3', '10-13', 900]]
+
+    assert history.pick_weights('vallihaudankatu-turku', restaurants, window = 4, today = TODAY) == [0.2, 0.4, 1.0]
+    assert history.pick_weights('kamppi-helsinki', restaurants, today = TODAY) == [1.0, 1.0, 1.0]
+
+
+def test_picks_skip_broken_lines():
+    history.record_pick('vallihaudankatu-turku', 'Pinni', day(0))
+    with open(f'{history._location_dir("vallihaudankatu-turku")}/picks.jsonl', 'a', encoding = 'utf-8') as f:
+        f.write('{"date": "2024-11-02"}\n{"date": "huomenna", "name": "Kupla"}\n{"date": "2024-1')
+
+    assert history.picks('vallihaudankatu-turku', today = TODAY) == [('2024-11-02', 'Pinni')]
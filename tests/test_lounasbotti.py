@@ -0,0 +1,80 @@
+import threading
+import time
+import pytest
+from lunchbot import lounasbotti
+from lunchbot.restaurant_scraper import Restaurants
+
+WEATHER = {'temperature_now': 21.5, 'rain_now': 0.0, 'temp_in_an_hour': 22.0, 'rain_in_an_hour': 0.0,
+           'terrace_now': True, 'terrace_in_an_hour': False}
+
+RESTAURANTS = Restaurants.from_cleaned([['Pinni', '10-14', 'Lohikeitto', 200], ['Kupla', '11-14', 'Pasta', 450]])
+
+
+@pytest.fixture
+def stages(monkeypatch):
+    '''
+    Stub weather and restaurant stages. Set stages['weather'] or stages['restaurants'] to an
+    exception to raise it, or to 'late' to keep the stage running past any deadline.
+    '''
+    results = {'weather': WEATHER, 'restaurants': (RESTAURANTS, 'http')}
+    release = threading.Event()
+
+    def stage(name):
+        def run(*args):
+            if results[name] == 'late':
+                release.wait(10)
+            if isinstance(results[name], Exception):
+                raise results[name]
+            return results[name]
+        return run
+
+    monkeypatch.setattr(lounasbotti, 'fetch_weather', stage('weather'))
+    monkeypatch.setattr(lounasbotti, 'fetch_restaurants', stage('restaurants'))
+    yield results
+    release.set()
+
+
+def test_both_stages_succeed(stages, capsys):
+    assert lounasbotti.fetch_concurrently('turku', 'https://x/vallihaudankatu-turku', 11, timeout = 5) == \
+        (WEATHER, (RESTAURANTS, 'http'), {})
+
+    lounasbotti.run('vallihaudankatu-turku', 500, 11, False, 'auto', 5, False, False, False, True)
+    out = capsys.readouterr().out
+    assert 'Weather read.' in out
+    assert 'Restaurants read: 2 in total (backend: http)' in out
+    assert 'Päivän ravintolana toimii' in out
+    assert 'Lämpötila nyt: 21.5' in out
+
+
+def test_a_failed_stage_keeps_the_other(stages, capsys):
+    stages['restaurants'] = ConnectionError('lounaat.info down')
+
+    weather, restaurants, errors = lounasbotti.fetch_concurrently('turku', 'https://x/vallihaudankatu-turku', 11,
+                                                                  timeout = 5)
+    assert (weather, restaurants) == (WEATHER, None)
+    assert list(errors) == ['restaurants'] and errors['restaurants'] is stages['restaurants']
+
+    with pytest.raises(SystemExit) as raised:
+        lounasbotti.run('vallihaudankatu-turku', 500, 11, False, 'auto', 5, False, False, False, True)
+    assert raised.value.code == 1
+    out = capsys.readouterr().out
+    assert 'lounaat.info down' in out
+    assert 'Päivän ravintolana' not in out
+    assert 'Lämpötila nyt: 21.5' in out
+
+
+def test_a_late_stage_is_given_up_at_the_deadline(stages, capsys):
+    stages['weather'] = 'late'
+
+    started = time.perf_counter()
+    weather, restaurants, errors = lounasbotti.fetch_concurrently('turku', 'https://x/vallihaudankatu-turku', 11,
+                                                                  timeout = 0.2)
+    assert time.perf_counter() - started < 2
+    assert (weather, restaurants) == (None, (RESTAURANTS, 'http'))
+    assert isinstance(errors['weather'], TimeoutError)
+
+    lounasbotti.run('vallihaudankatu-turku', 500, 11, False, 'auto', 0.2, False, False, False, True)
+    out = capsys.readouterr().out
+    assert 'Weather could not be read: weather not fetched within 0.2 seconds' in out
+    assert 'Päivän ravintolana toimii' in out
+    assert 'Lämpötila nyt' not in out
@@ -0,0 +1,87 @@
+import pytest
+from benchmarks.fixtures import lounaat_html
+from benchmarks.stub_server import StubServer
+from lunchbot.restaurant_scraper import (Restaurants, clean_menu_list, clean_menu_records, fetch_menu_records,
+                                         menu_record, parse_menu_html)
+
+PAGE = '''<html><head><script>var x = '<div class="menu item category-1">';</script></head><body>
+<div class="banner"><div>Mainos</div></div>
+<div class="menu item category-2 lunch">
+  <div class="item-header"><h3><a href="/lounas/pinni/turku">Pinni &amp; Co</a></h3><p>10.30&ndash;14.00</p></div>
+  <div class="item-body"><ul>
+    <li><p class="dish">Lohikeitto   L, G</p><p class="price">11.50 €</p></li>
+    <li><p class="dish">Kasvislasagne VE</p><script>track()</script></li>
+  </ul></div>
+  <div class="item-footer"><p class="dist">1,2km</p><div class="rating">4.5/5</div></div>
+</div>
+<div class="menu item category-3"><div>Tyhjä</div></div>
+</body></html>
+'''
+
+
+def test_parse_menu_html_renders_one_blob_per_menu_div():
+    assert parse_menu_html(PAGE) == [
+        'Pinni & Co\n10.30–14.00\nLohikeitto L, G\n11.50 €\nKasvislasagne VE\n1,2km\n4.5/5',
+        'Tyhjä',
+    ]
+
+
+@pytest.mark.parametrize('content_type', ['text/html', 'text/html; charset=utf-8', 'text/html; Charset="UTF-8"'])
+def test_http_backend_reads_utf_8(content_type):
+    page = PAGE.replace('<div class="menu item category-3">', '''<div class="menu item category-4">
+      <h3>Kårkafé Åbo</h3><p>10-14</p><p>Pyttipannu 8,00 €</p><p>300m</p></div>
+    <div class="menu item category-3">''')
+    with StubServer({'/vallihaudankatu-turku': (page, content_type)}) as server:
+        records, backend = fetch_menu_records(server.url + '/vallihaudankatu-turku', timeout = 5, backend = 'http')
+
+    assert backend == 'http'
+    assert [record['name'] for record in records] == ['Pinni & Co', 'Kårkafé Åbo']
+    assert records[0]['menu'] == ['Lohikeitto L, G', '11.50 €', 'Kasvislasagne VE']
+    assert [setti[0] for setti in clean_menu_records(records)] == ['Pinni & Co']
+
+
+def test_menu_record_drops_ratings_and_short_divs():
+    assert menu_record('Pinni & Co\n10.30–14.00\nLohikeitto L, G\n11.50 €\n1,2km\n4.5/5') == {
+        'name': 'Pinni & Co', 'hours': '10.30–14.00', 'menu': ['Lohikeitto L, G', '11.50 €'], 'distance': '1,2km'}
+    assert menu_record(' Pinni & Co \n\n  \n10-14\n1,2km\n') == {
+        'name': 'Pinni & Co', 'hours': '10-14', 'menu': [], 'distance': '1,2km'}
+    assert menu_record('Tyhjä') is None
+    assert menu_record('Tyhjä\n4.5/5') is None
+
+
+def test_clean_menu_list_of_a_page():
+    restaurants = clean_menu_list(parse_menu_html(lounaat_html(14, filler = 10)))
+
+    assert [setti[0] for setti in restaurants] == [f'Ravintola {i}' for i in range(14) if i % 7 != 3]
+    assert restaurants[0] == ['Ravintola 0', 'Avoinna 10.30–14.00',
+                              'Lohikeitto L, G', '9.50 €', 'Broileria currykastikkeessa, riisiä M, G', '10.50 €', 50]
+
+
+RESTAURANTS = [['Kaukana', '10-14', 'Keitto', 900], ['Lähellä', '11-13', 200],
+               ['Keskellä', '10-15', 'Pasta', 'Salaatti', 500], ['Myös keskellä', '10-14', 'Pizza', 500]]
+
+
+def test_restaurants_are_sorted_by_distance():
+    restaurants = Restaurants.from_cleaned(RESTAURANTS)
+
+    assert len(restaurants) == 4
+    assert restaurants.to_list() == [['Lähellä', '11-13', 200], ['Keskellä', '10-15', 'Pasta', 'Salaatti', 500],
+                                     ['Myös keskellä', '10-14', 'Pizza', 500], ['Kaukana', '10-14', 'Keitto', 900]]
+
+
+def test_restaurants_within():
+    restaurants = Restaurants.from_cleaned(RESTAURANTS)
+
+    assert restaurants.within(499).names == ['Lähellä']
+    assert restaurants.within(500).names == ['Lähellä', 'Keskellä', 'Myös keskellä']
+    assert len(restaurants.within(100)) == 0
+    assert len(restaurants.within(10000)) == 4
+
+
+def test_restaurants_nearest():
+    restaurants = Restaurants.from_cleaned(RESTAURANTS)
+
+    assert restaurants.nearest(2).names == ['Lähellä', 'Keskellä']
+    assert restaurants.within(500).nearest(5).to_list() == restaurants.within(500).to_list()
+    assert restaurants.nearest(1)[0] == ['Lähellä', '11-13', 200]
+    assert list(restaurants.nearest(3).distances) == [200, 500, 500]
@@ -0,0 +1,143 @@
+import datetime
+from urllib.parse import parse_qs, urlparse
+import pytest
+from benchmarks.fixtures import fmi_xml
+from benchmarks.stub_server import StubHandler, StubServer
+from lunchbot import weather
+from lunchbot.weather import ForecastStore
+
+DAY = datetime.datetime(2024, 10, 18)
+
+
+def hour(h):
+    return DAY + datetime.timedelta(hours = h)
+
+
+def fmi_records(xml):
+    '''The records get_weather_records makes of a forecast document.'''
+    return [{**record, 'ParameterValue': float(record['ParameterValue'])}
+            for record in weather._iter_weather_elements(xml) if record['ParameterName'] in weather.WEATHER_PARAMETERS]
+
+
+@pytest.mark.parametrize('hours', [12, 30])
+def test_index_weather_lean_matches_index_weather(hours):
+    records = fmi_records(fmi_xml(hours, DAY.date().isoformat()))
+    # Cache entries written by earlier versions have +00:00 times
+    old_records = [{**record, 'Time': record['Time'].replace('Z', '+00:00')} for record in records]
+
+    expected = weather.index_weather(weather.weather_from_records(records))
+    for lean in (weather.index_weather_lean(records), weather.index_weather_lean(old_records)):
+        assert sorted(lean) == sorted(expected.index)
+        for h, values in lean.items():
+            assert list(values) == weather.WEATHER_PARAMETERS
+            assert values == pytest.approx(expected.loc[h].to_dict(), nan_ok = True)
+
+
+@pytest.fixture
+def fmi(monkeypatch):
+    '''Stub FMI answering each query with the hours it asks for. Yields the (first, last) hour of each query.'''
+    queries = []
+    serve = StubHandler.do_GET
+
+    def do_GET(handler):
+        query = parse_qs(urlparse(handler.path).query)
+        start, end = (datetime.datetime.strptime(query[name][0], '%Y-%m-%dT%H:%M:%SZ')
+                      for name in ('starttime', 'endtime'))
+        queries.append((start.hour, end.hour))
+        handler.server.pages['/wfs'] = (fmi_xml(end.hour - start.hour, start.date().isoformat(), start.hour).encode(),
+                                        'text/xml')
+        serve(handler)
+
+    monkeypatch.setattr(StubHandler, 'do_GET', do_GET)
+    with StubServer({}) as server:
+        monkeypatch.setattr(weather, 'FMI_URL', server.url + '/wfs')
+        yield queries
+
+
+def hours_of(records):
+    return sorted({int(record['Time'][11:13]) for record in records})
+
+
+def test_fetches_only_the_missing_end_of_a_window(fmi):
+    store = ForecastStore()
+
+    assert hours_of(store.records('Turku', hour(8), hour(11))) == [8, 9, 10, 11]
+    records = store.records('turku', hour(10), hour(13))
+
+    assert fmi == [(8, 11), (12, 13)]
+    assert hours_of(records) == [10, 11, 12, 13]
+    assert len(records) == 4 * len(weather.WEATHER_PARAMETERS)
+
+
+def test_fetches_a_gap_once_and_reuses_a_held_window(fmi):
+    store = ForecastStore()
+    store.records('turku', hour(8), hour(9))
+    store.records('turku', hour(12), hour(13))
+
+    assert hours_of(store.records('turku', hour(8), hour(13))) == [8, 9, 10, 11, 12, 13]
+    assert hours_of(store.records('turku', hour(9), hour(12))) == [9, 10, 11, 12]
+    assert fmi == [(8, 9), (12, 13), (10, 11)]
+
+
+def test_refetches_on_refresh_stale_hours_and_other_cities(fmi):
+    store = ForecastStore()
+    store.records('turku', hour(8), hour(9))
+    store.records('turku', hour(8), hour(9), refresh = True)
+    store.records('helsinki', hour(8), hour(9))
+    assert fmi == [(8, 9), (8, 9), (8, 9)]
+
+    stale = ForecastStore(max_age = -1)
+    stale.records('turku', hour(8), hour(9))
+    stale.records('turku', hour(8), hour(9))
+    assert fmi[3:] == [(8, 9), (8, 9)]
+
+    store.clear()
+    store.records('turku', hour(8), hour(9))
+    assert len(fmi) == 6
+
+
+def test_serves_held_hours_purged_during_the_fetch(fmi, monkeypatch):
+    store = ForecastStore()
+    store.records('turku', hour(8), hour(9))
+    fetch = weather.get_weather_records
+
+    def fetch_while_purged(*args, **kwargs):
+        # Another city's fetch drops the stale hours of every city under the shared lock
+        store.clear()
+        return fetch(*args, **kwargs)
+
+    monkeypatch.setattr(weather, 'get_weather_records', fetch_while_purged)
+    assert hours_of(store.records('turku', hour(8), hour(11))) == [8, 9, 10, 11]
+    assert fmi == [(8, 9), (10, 11)]
+
+
+def test_index_weather_keeps_the_latest_forecast_of_an_hour():
+    # 08:00 to 14:00 the next day, so 08-14 are forecast for both days
+    xml = fmi_xml(30, DAY.date().isoformat())
+    latest = {}
+    for record in fmi_records(xml):
+        key = (int(record['Time'][11:13]), record['ParameterName'])
+        if record['Time'] >= latest.get(key, ('', None))[0]:
+            latest[key] = (record['Time'], record['ParameterValue'])
+
+    weather_index = weather.index_weather(weather.get_weather(weather.parse_weather_xml(xml)))
+
+    assert sorted(weather_index.index) == list(range(24))
+    assert list(weather_index.columns) == weather.WEATHER_PARAMETERS
+    assert {(h, name): weather_index.loc[h, name] for h in weather_index.index for name in weather_index.columns} == \
+        pytest.approx({key: value for key, (_, value) in latest.items()}, nan_ok = True)
+    assert latest[(9, 'Temperature')][0].startswith('2024-10-19')
+
+
+@pytest.mark.parametrize('min_temp', [10, 15, 20])
+def test_terrace_weather_by_hour_matches_terrace_weather(min_temp):
+    weather_index = weather.index_weather(weather.get_weather(weather.parse_weather_xml(
+        fmi_xml(30, DAY.date().isoformat()))))
+
+    by_hour = weather.terrace_weather_by_hour(weather_index, min_temp = min_temp)
+
+    assert list(by_hour.index) == list(weather_index.index)
+    assert by_hour.to_dict() == {h: weather.terrace_weather(weather_index.loc[h], min_temp = min_temp)
+                                 for h in weather_index.index}
+    if min_temp < 20:
+        assert by_hour.any() and not by_hour.all()